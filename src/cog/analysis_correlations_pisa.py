@@ -42,7 +42,7 @@ def analyze_correlations():
     print("="*60)
 
     out_excel = XLSX_DIR / 'pisa_correlations_waves.xlsx'
-    writer = pd.ExcelWriter(out_excel, engine='openpyxl')
+    writer = pd.ExcelWriter(out_excel, engine='xlsxwriter')
     
     for year, info in FILES.items():
         filename = info['file']
@@ -55,7 +55,10 @@ def analyze_correlations():
             
         print(f"\n--- Processando Onda {year} [{label_desc}] ---")
         try:
-            df = pd.read_csv(fpath)
+            # Espelho Parquet só vale se não for mais antigo que o CSV (nem todo script que grava o CSV grava o Parquet)
+            parquet_path = fpath.with_suffix('.parquet')
+            fresh = parquet_path.exists() and parquet_path.stat().st_mtime >= fpath.stat().st_mtime
+            df = pd.read_parquet(parquet_path) if fresh else pd.read_csv(fpath)
             
             # Filtra colunas numéricas de interesse (Notas e Contagens)
             # Ignora colunas categóricas (Region, UF)
@@ -68,8 +68,6 @@ B. ONDAS 2 e 3 (2018/2022) - "VISÃO REGIONAL" (Anonimizada)
 import pandas as pd
 import numpy as np
 import os
-import seaborn as sns
-import matplotlib.pyplot as plt
 from pathlib import Path
 
 # --- CONFIGURAÇÃO ---
@@ -106,6 +104,9 @@ UF_TO_REGION = {
     'PE':'Northeast', 'PI':'Northeast', 'RJ':'Southeast', 'RN':'Northeast', 'RS':'South', 
     'RO':'North', 'RR':'North', 'SC':'South', 'SP':'Southeast', 'SE':'Northeast', 'TO':'North'
 }
+# UF -> código inteiro da região, montado uma vez no carregamento do módulo
+REGION_CAT = pd.CategoricalDtype(['North', 'Northeast', 'Southeast', 'South', 'Center-West'])
+UF_TO_REGION_SER = pd.Series(UF_TO_REGION).astype(REGION_CAT)
 
 def load_file_smart(path_obj):
     if path_obj.exists():
@@ -164,12 +165,25 @@ def aggregate_to_region(df_state):
     
     sample = str(df['KEY'].iloc[0])
     if len(sample) == 2 and sample in UF_TO_REGION:
-        df['Region'] = df['KEY'].map(UF_TO_REGION)
+        # UF fora do mapa vira código -1 e fica fora da agregação
+        codes = UF_TO_REGION_SER.reindex(df['KEY'].astype(str)).cat.codes.to_numpy()
+        n_reg = len(REGION_CAT.categories)
         
         # Filtra apenas colunas que são Score ou Grade NUMÉRICA
         target_cols = [c for c in df.columns if ('Score' in c or 'Grade' in c) and pd.api.types.is_numeric_dtype(df[c])]
         
-        return df.groupby('Region')[target_cols].mean().reset_index().rename(columns={'Region': 'KEY'})
+        # Média por região via np.bincount sobre os códigos (NaN ignorado, como no groupby)
+        out = {}
+        seen = np.bincount(codes[codes >= 0], minlength=n_reg) > 0
+        for c in target_cols:
+            v = df[c].to_numpy(dtype='float64')
+            valid = (codes >= 0) & ~np.isnan(v)
+            total = np.bincount(codes[valid], weights=v[valid], minlength=n_reg)
+            n = np.bincount(codes[valid], minlength=n_reg)
+            with np.errstate(invalid='ignore', divide='ignore'):
+                out[c] = np.where(n > 0, total / n, np.nan)
+        res = pd.DataFrame(out, index=pd.Index(REGION_CAT.categories, name='KEY'))
+        return res[seen].sort_index().reset_index()
     
     return df
 
@@ -178,7 +192,7 @@ def run_triangulation():
     print("      TRIANGULAÇÃO V1.4 (Safe Numeric Aggregation)")
     print("="*60)
     
-    writer = pd.ExcelWriter(REPORTS_XLSX / 'triangulation_waves_consolidated.xlsx', engine='openpyxl')
+    writer = pd.ExcelWriter(REPORTS_XLSX / 'triangulation_waves_consolidated.xlsx', engine='xlsxwriter')
     
     for wave, srcs in FILES_MAP.items():
         print(f"\n--- Processando Onda {wave} ---")
@@ -199,13 +213,9 @@ def run_triangulation():
 
         # --- 1. VISÃO REGIONAL ---
         print("   -> Gerando Tabela REGIONAL...")
-        df_final_reg = aggregate_to_region(df_pisa)
-        if df_enem is not None: 
-            df_enem_reg = aggregate_to_region(df_enem)
-            df_final_reg = pd.merge(df_final_reg, df_enem_reg, on='KEY', how='inner')
-        if df_saeb is not None:
-            df_saeb_reg = aggregate_to_region(df_saeb)
-            df_final_reg = pd.merge(df_final_reg, df_saeb_reg, on='KEY', how='inner')
+        # Todas as fontes compartilham a chave KEY: um único concat alinhado pelo índice (inner) no lugar da cadeia de merges
+        frames_reg = [aggregate_to_region(d) for d in (df_pisa, df_enem, df_saeb) if d is not None]
+        df_final_reg = pd.concat([d.set_index('KEY') for d in frames_reg], axis=1, join='inner').reset_index()
 
         if len(df_final_reg) > 0:
             df_final_reg.to_excel(writer, sheet_name=f'{wave}_Region_Data', index=False)
@@ -216,9 +226,8 @@ def run_triangulation():
         # --- 2. VISÃO ESTADUAL ---
         if wave == '2015':
             print("   -> Gerando Tabela ESTADUAL...")
-            df_final_st = df_pisa
-            if df_enem is not None: df_final_st = pd.merge(df_final_st, df_enem, on='KEY', how='inner')
-            if df_saeb is not None: df_final_st = pd.merge(df_final_st, df_saeb, on='KEY', how='inner')
+            frames_st = [d.set_index('KEY') for d in (df_pisa, df_enem, df_saeb) if d is not None]
+            df_final_st = pd.concat(frames_st, axis=1, join='inner').reset_index()
 
             if len(df_final_st) > 0:
                 df_final_st.to_excel(writer, sheet_name=f'{wave}_State_Data', index=False)
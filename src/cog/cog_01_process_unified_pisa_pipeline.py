@@ -27,6 +27,7 @@ RASTREABILITY SETTINGS:
     - INPUT_ROOT:  data/raw/Pisa/
     - OUTPUT_CSV:  data/processed/pisa_table_[year]_[scope].csv
     - LOG_FILE:    logs/pisa_pipeline_[year].log
+    - SAV_CACHE:   data/cache/[sav_stem]_[key].parquet (linhas do Brasil já decodificadas)
 
 DEPENDENCIES:
     pandas, numpy, pyreadstat, openpyxl, re
@@ -35,12 +36,16 @@ DEPENDENCIES:
 
 import pandas as pd
 import numpy as np
+import argparse
+import hashlib
+import multiprocessing
 import os
 import sys
 import time
 import pyreadstat
 from pathlib import Path
 import warnings
+from concurrent.futures import ProcessPoolExecutor
 
 warnings.filterwarnings("ignore")
 
@@ -52,10 +57,52 @@ REPORT_DIR = PROJECT_ROOT / 'reports' / 'varcog'
 CSV_OUT_DIR = PROJECT_ROOT / 'data' / 'processed'
 XLSX_OUT_DIR = REPORT_DIR / 'xlsx'
 LOG_DIR = PROJECT_ROOT / 'logs'
+CACHE_DIR = PROJECT_ROOT / 'data' / 'cache'
 
-for path in [CSV_OUT_DIR, XLSX_OUT_DIR, LOG_DIR]:
+for path in [CSV_OUT_DIR, XLSX_OUT_DIR, LOG_DIR, CACHE_DIR]:
     path.mkdir(parents=True, exist_ok=True)
 
+def load_spss_cached(sav_path, cols, loader):
+    """
+    Devolve o DataFrame produzido por loader(), reaproveitando um cache Parquet.
+    A chave combina caminho, tamanho, mtime e colunas do SAV: qualquer mudança
+    no arquivo ou na seleção de colunas gera um cache novo.
+    """
+    st = os.stat(sav_path)
+    key = hashlib.md5(f"{Path(sav_path).resolve()}:{st.st_size}:{st.st_mtime_ns}:{sorted(cols)}".encode()).hexdigest()[:12]
+    cache_path = CACHE_DIR / f"{Path(sav_path).stem}_{key}.parquet"
+    if cache_path.exists():
+        print(f"   [CACHE] {cache_path.name}")
+        return pd.read_parquet(cache_path)
+
+    df = loader()
+    # Escrita atômica: um .part interrompido nunca é lido como cache válido
+    tmp_path = cache_path.with_suffix('.part')
+    df.to_parquet(tmp_path, engine='pyarrow', compression='zstd', index=False)
+    os.replace(tmp_path, cache_path)
+    return df
+
+def group_means(keys, frame, cols, weights=None):
+    """
+    Médias (opcionalmente ponderadas) de cols por grupo de keys, ignorando NaN.
+    Os grupos viram códigos inteiros uma única vez e cada coluna é reduzida com
+    np.bincount, sem o laço Python por grupo do groupby/apply.
+    """
+    codes, uniques = pd.factorize(keys, sort=True)
+    n_groups = len(uniques)
+    w = None if weights is None else pd.to_numeric(weights, errors='coerce').to_numpy(dtype='float64')
+    out = {}
+    for col in cols:
+        v = pd.to_numeric(frame[col], errors='coerce').to_numpy(dtype='float64')
+        valid = (codes >= 0) & ~np.isnan(v)
+        if w is not None: valid &= ~np.isnan(w)
+        wv = None if w is None else w[valid]
+        num = np.bincount(codes[valid], weights=v[valid] if wv is None else v[valid] * wv, minlength=n_groups)
+        den = np.bincount(codes[valid], weights=wv, minlength=n_groups)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            out[col] = np.where(den > 0, num / den, np.nan)
+    return pd.DataFrame(out, index=pd.Index(uniques, name=keys.name))
+
 # --- WINDOWS TIMEOUT INPUT UTILITY (FIXED: getwch) ---
 try:
     import msvcrt
@@ -83,13 +130,17 @@ except ImportError:
         return res if res else default
 
 class PisaUnifiedETL:
-    def __init__(self, mode='BOTH', user_concepts=None):
+    def __init__(self, mode='BOTH', user_concepts=None, write_xlsx=True, sav_procs=None):
         """
         :param mode: 'SIMPLE', 'WEIGHTED', 'BOTH'
         :param user_concepts: List of concept keys (e.g. ['Math', 'Global']) or None for ALL.
+        :param write_xlsx: False skips the XLSX report (CSV is what downstream stages read).
+        :param sav_procs: Processes used to decode each SAV (default: all cores).
         """
         self.mode = mode.upper()
         self.user_concepts = user_concepts
+        self.write_xlsx = write_xlsx
+        self.sav_procs = sav_procs or os.cpu_count() or 1
         
         # Base Translations
         self.translate_map = {
@@ -120,26 +171,8 @@ class PisaUnifiedETL:
     def _calc_weighted(self, df, group_col, val_cols):
         """Calculates weighted mean using W_FSTUWT (Robust to NaNs)."""
         try:
-            results = []
-            df['W_FSTUWT'] = pd.to_numeric(df['W_FSTUWT'], errors='coerce')
-            
-            for col in val_cols:
-                df[col] = pd.to_numeric(df[col], errors='coerce')
-                
-                def weighted_avg(x):
-                    valid = x[col].notna() & x['W_FSTUWT'].notna()
-                    d = x.loc[valid, col]
-                    w = x.loc[valid, 'W_FSTUWT']
-                    if w.sum() > 0:
-                        return np.average(d, weights=w)
-                    return np.nan
-
-                wm = df.groupby(group_col).apply(weighted_avg).reset_index(name=f'{col}_Ponderada')
-                results.append(wm)
-            
-            final_w = results[0]
-            for r in results[1:]: final_w = pd.merge(final_w, r, on=group_col)
-            return final_w
+            means_w = group_means(df[group_col], df, val_cols, weights=df['W_FSTUWT'])
+            return means_w.add_suffix('_Ponderada').reset_index()
         except Exception as e:
             # print(f"   [DEBUG] Weighted calc issue: {e}") 
             return None
@@ -210,7 +243,7 @@ class PisaUnifiedETL:
                 keep_cols.append(col)
         
         # Deduplicate
-        df = df[list(set(keep_cols))]
+        df = df[list(dict.fromkeys(keep_cols))]
 
         # 5. Order
         priority = ['Ano', 'Região', 'UF', 'Média_Geral', 'Média_Geral_Ponderada', 'N_Alunos']
@@ -235,7 +268,11 @@ class PisaUnifiedETL:
         full_name = f"{fname}{suffix}"
         
         df.to_csv(CSV_OUT_DIR / f"{full_name}.csv", index=False)
-        df.to_excel(XLSX_OUT_DIR / f"{full_name}.xlsx", index=False)
+        if not self.write_xlsx:
+            print(f"   [OK] Gerado: {full_name}.csv | N: {int(df['N_Alunos'].sum())}")
+            return
+        with pd.ExcelWriter(XLSX_OUT_DIR / f"{full_name}.xlsx", engine='xlsxwriter') as writer:
+            df.to_excel(writer, index=False)
         print(f"   [OK] Gerado: {full_name}.xlsx | N: {int(df['N_Alunos'].sum())}")
 
     def run_2015(self):
@@ -256,25 +293,36 @@ class PisaUnifiedETL:
             _, meta = pyreadstat.read_sav(str(target_file), metadataonly=True)
             region_col = next((c for c in ['STRATUM', 'REGION', 'CNT', 'ST004D01T'] if c in meta.column_names), None)
             scores = [c for c in meta.column_names if c.startswith('PV1') and any(x in c for x in ['MATH', 'READ', 'SCIE'])]
-            use_cols = list(set([region_col] + scores + ['W_FSTUWT']))
+            use_cols = [region_col] + scores + ['W_FSTUWT']
             if 'CNT' in meta.column_names: use_cols.append('CNT')
+            use_cols = list(dict.fromkeys(use_cols))
 
-            df, meta = pyreadstat.read_sav(str(target_file), usecols=use_cols)
-            if 'CNT' in df.columns: df = df[df['CNT'] == 'BRA'].copy()
+            def read_brazil():
+                # Leitura em paralelo por faixas de linhas (decodificação SAV é CPU-bound)
+                df, _ = pyreadstat.read_file_multiprocessing(
+                    pyreadstat.read_sav, str(target_file), num_processes=self.sav_procs, usecols=use_cols,
+                    disable_datetime_conversion=True
+                )
+                # Seleção booleana já devolve um novo frame; dispensa cópia defensiva
+                if 'CNT' in df.columns: df = df.loc[(df['CNT'] == 'BRA').to_numpy()]
+                return df
 
+            df = load_spss_cached(target_file, use_cols, read_brazil)
+
+            stratum = df[region_col].astype(str)
             if region_col in meta.variable_value_labels:
-                labels = meta.variable_value_labels[region_col]
-                df['STRATUM_TEXT'] = df[region_col].map(labels).fillna(df[region_col].astype(str))
-            else: df['STRATUM_TEXT'] = df[region_col].astype(str)
-
-            def resolve_ibge(txt):
-                if not isinstance(txt, str): return None
-                txt = txt.upper()
-                for k in sorted(NAME_TO_IBGE.keys(), key=len, reverse=True):
-                    if k in txt: return NAME_TO_IBGE[k]
-                return None
-            
-            df['IBGE_CODE'] = df['STRATUM_TEXT'].apply(resolve_ibge)
+                stratum = df[region_col].map(meta.variable_value_labels[region_col]).fillna(stratum)
+            df = df.assign(STRATUM_TEXT=stratum)
+
+            # Cada rótulo distinto de estrato é resolvido uma vez (vence o nome mais longo contido nele,
+            # como no laço original); o código IBGE é propagado aos alunos pela categoria
+            def ibge_code_for(label):
+                hits = [n for n in NAME_TO_IBGE if n in label]
+                return NAME_TO_IBGE[max(hits, key=len)] if hits else np.nan
+
+            strat = df['STRATUM_TEXT'].astype('category')
+            code_lut = np.array([ibge_code_for(c) for c in strat.cat.categories.astype(str).str.upper()] + [np.nan])
+            df['IBGE_CODE'] = code_lut[strat.cat.codes.to_numpy()]
             df = df.dropna(subset=['IBGE_CODE'])
             
             rename_pv = {'PV1MATH': 'Math', 'PV1READ': 'Read', 'PV1SCIE': 'Science'}
@@ -284,7 +332,7 @@ class PisaUnifiedETL:
             summary.columns = ['IBGE_CODE', 'Student_Count']
             
             if self.mode in ['SIMPLE', 'BOTH']:
-                means = df.groupby('IBGE_CODE')[['Math', 'Read', 'Science']].mean().reset_index()
+                means = group_means(df['IBGE_CODE'], df, ['Math', 'Read', 'Science']).reset_index()
                 summary = pd.merge(summary, means, on='IBGE_CODE')
                 summary['Cognitive_Global_Mean'] = summary[['Math', 'Read', 'Science']].mean(axis=1)
 
@@ -317,47 +365,62 @@ class PisaUnifiedETL:
     def _generic_regional_run(self, file_path, year):
         cols = ['CNT', 'STRATUM', 'PV1MATH', 'PV1READ', 'PV1SCIE', 'W_FSTUWT']
         try:
-            df = pd.read_spss(str(file_path), usecols=cols)
-            df = df[df['CNT'].astype(str).str.contains('BRA|Brazil|76', case=False, na=False)].copy()
+            def read_brazil():
+                # Leitura em blocos (decodificados em paralelo): só as linhas do Brasil ficam em memória
+                reader = pyreadstat.read_file_in_chunks(
+                    pyreadstat.read_sav, str(file_path), chunksize=100_000, usecols=cols,
+                    multiprocess=True, num_processes=max(1, self.sav_procs // 2),
+                    apply_value_formats=True, formats_as_category=True
+                )
+                keep = []
+                for chunk, _ in reader:
+                    # CNT já vem Categorical: o teste roda sobre as categorias e é propagado pelos códigos
+                    cnt = chunk['CNT'].astype('category')
+                    is_bra = np.append(cnt.cat.categories.isin(['BRA', 'Brazil']), False)
+                    chunk = chunk[is_bra[cnt.cat.codes.to_numpy()]]
+                    if not chunk.empty: keep.append(chunk)
+                return pd.concat(keep, ignore_index=True) if keep else pd.DataFrame(columns=cols)
+
+            df = load_spss_cached(file_path, cols, read_brazil)
             if df.empty: print("[ERRO] Dados Brasil vazios."); return
 
-            def get_region(s, y):
-                s = str(s).upper().strip()
-                if y == 2018:
-                    if s.startswith('BRA'):
-                        code = s[3:5]
-                        if code == '01': return 'North'
-                        if code == '02': return 'Northeast'
-                        if code == '03': return 'Southeast'
-                        if code == '04': return 'South'
-                        if code == '05': return 'Center-West'
-                else: # 2022
-                    if 'CENTRO' in s: return 'Center-West'
-                    if 'NORDESTE' in s: return 'Northeast'
-                    if 'SUDESTE' in s: return 'Southeast'
-                    if 'NORTE' in s: return 'North'
-                    if 'SUL' in s: return 'South'
-                return 'UNKNOWN'
-
-            df['Region'] = df['STRATUM'].apply(lambda x: get_region(x, year))
-            df = df[df['Region'] != 'UNKNOWN']
-            
-            summary = df['Region'].value_counts().reset_index()
-            summary.columns = ['Region', 'Student_Count']
+            # STRATUM como Categorical: normalização de texto e região resolvidas uma vez por estrato distinto, não por aluno
+            strat = df['STRATUM'].astype('category')
+            cats = pd.Series(strat.cat.categories.astype(str).str.upper().str.strip())
+            if year == 2018:
+                codes = cats.str[3:5].where(cats.str.startswith('BRA'))
+                region_per_cat = codes.map({'01': 'North', '02': 'Northeast', '03': 'Southeast', '04': 'South', '05': 'Center-West'})
+            else: # 2022 (ordem importa: CENTRO/NORDESTE/SUDESTE antes de NORTE/SUL)
+                region_per_cat = pd.Series(np.select(
+                    [cats.str.contains(k, regex=False) for k in ['CENTRO', 'NORDESTE', 'SUDESTE', 'NORTE', 'SUL']],
+                    ['Center-West', 'Northeast', 'Southeast', 'North', 'South'], default=None
+                ), index=cats.index)
+
+            # Posição extra (None) recebe o código -1 de STRATUM ausente
+            df['Region'] = np.append(region_per_cat.to_numpy(dtype=object), None)[strat.cat.codes.to_numpy()]
+            df = df.dropna(subset=['Region'])
             
+            # Region em códigos inteiros: contagem e médias saem de reduções np.bincount
+            df['Region'] = df['Region'].astype('category')
+            counts = df['Region'].value_counts(sort=False)
+            counts = counts[counts > 0].rename('Student_Count')
             if self.mode in ['SIMPLE', 'BOTH']:
-                means = df.groupby('Region')[['PV1MATH', 'PV1READ', 'PV1SCIE']].mean().reset_index()
-                summary = pd.merge(summary, means, on='Region')
-                summary['Cognitive_Global_Mean'] = (summary['PV1MATH'] + summary['PV1READ'] + summary['PV1SCIE']) / 3
+                means = group_means(df['Region'], df, ['PV1MATH', 'PV1READ', 'PV1SCIE'])
+                means.columns = ['Math_Mean', 'Read_Mean', 'Science_Mean']
+                summary = pd.concat([counts, means], axis=1, join='inner').rename_axis('Region').reset_index()
+                summary['Cognitive_Global_Mean'] = summary[['Math_Mean', 'Read_Mean', 'Science_Mean']].mean(axis=1)
+            else:
+                summary = counts.rename_axis('Region').reset_index()
+            summary['Region'] = summary['Region'].astype(str)
             
             if self.mode in ['WEIGHTED', 'BOTH']:
                 means_w = self._calc_weighted(df, 'Region', ['PV1MATH', 'PV1READ', 'PV1SCIE'])
                 if means_w is not None:
+                    means_w['Region'] = means_w['Region'].astype(str)
                     summary = pd.merge(summary, means_w, on='Region')
                     summary['Cognitive_Global_Mean_Ponderada'] = (summary['PV1MATH_Ponderada'] + summary['PV1READ_Ponderada'] + summary['PV1SCIE_Ponderada']) / 3
 
-            ren = {'PV1MATH': 'Math_Mean', 'PV1READ': 'Read_Mean', 'PV1SCIE': 'Science_Mean',
-                   'PV1MATH_Ponderada': 'Matemática_Ponderada', 'PV1READ_Ponderada': 'Leitura_Ponderada', 'PV1SCIE_Ponderada': 'Ciências_Ponderada'}
+            ren = {'PV1MATH_Ponderada': 'Matemática_Ponderada', 'PV1READ_Ponderada': 'Leitura_Ponderada', 'PV1SCIE_Ponderada': 'Ciências_Ponderada'}
             summary = summary.rename(columns=ren)
             
             final_df = self._apply_standardization(summary, year)
@@ -365,8 +428,22 @@ class PisaUnifiedETL:
 
         except Exception as e: print(f"   [ERRO] {e}")
 
+def run_year(task):
+    """Worker: processa um ciclo (top-level para ser serializável pelo ProcessPoolExecutor)."""
+    year, mode, user_concepts, write_xlsx, sav_procs = task
+    etl = PisaUnifiedETL(mode=mode, user_concepts=user_concepts, write_xlsx=write_xlsx, sav_procs=sav_procs)
+    if year == 2015: etl.run_2015()
+    elif year == 2018: etl.run_2018()
+    elif year == 2022: etl.run_2022()
+    else: print(f"[AVISO] Ano {year} não suportado.")
+
 def main():
-    os.system('cls' if os.name == 'nt' else 'clear')
+    parser = argparse.ArgumentParser(description="PISA unified pipeline")
+    parser.add_argument("--no-xlsx", action="store_true", help="Grava apenas os CSVs, sem o relatório XLSX.")
+    args = parser.parse_args()
+
+    if os.name == 'nt': os.system('')  # enable ANSI escape handling on the Windows console
+    print('\033[2J\033[H', end='', flush=True)
     print("=== PISA UNIFIED PIPELINE v8.1 ===")
     
     # 1. YEARS
@@ -417,13 +494,17 @@ def main():
     print(f"[CONFIG] Anos: {years} | Modo: {selected_mode} | Indicadores: {'TODOS' if not user_concepts else len(user_concepts)}")
     print("-" * 60)
 
-    etl = PisaUnifiedETL(mode=selected_mode, user_concepts=user_concepts)
-
-    for year in years:
-        if year == 2015: etl.run_2015()
-        elif year == 2018: etl.run_2018()
-        elif year == 2022: etl.run_2022()
-        else: print(f"[AVISO] Ano {year} não suportado.")
+    # Ciclos independentes: com mais de um ano, cada ciclo roda em seu processo e
+    # os núcleos de decodificação do SAV são divididos entre eles
+    years = list(dict.fromkeys(years))
+    if len(years) > 1:
+        workers = min(len(years), os.cpu_count() or 1)
+        sav_procs = max(1, (os.cpu_count() or 1) // workers)
+        tasks = [(y, selected_mode, user_concepts, not args.no_xlsx, sav_procs) for y in years]
+        with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context('spawn')) as ex:
+            list(ex.map(run_year, tasks))
+    else:
+        for y in years: run_year((y, selected_mode, user_concepts, not args.no_xlsx, None))
 
     print("\n[CONCLUÍDO] PISA Finalizado.")
 
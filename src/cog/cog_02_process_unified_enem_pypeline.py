@@ -23,20 +23,29 @@ ABSTRACT:
 RASTREABILITY SETTINGS:
     - INPUT_ROOT:  data/raw/enem/
     - OUTPUT_CSV:  data/processed/enem_table_[year]_[filter].csv
+    - RAW_CACHE:   data/cache/enem_unified_[year].parquet
     - LOG_FILE:    logs/enem_pipeline_[year].log
 
 DEPENDENCIES:
-    pandas, numpy, zipfile, logging, os
+    pandas, numpy, pyarrow, zipfile, logging, os
 ================================================================================
 """
 
 import pandas as pd
 import numpy as np
+import pyarrow as pa
+import pyarrow.csv as pacsv
+import pyarrow.parquet as pq
+import contextlib
+import functools
+import io
 import os
 import zipfile
 import logging
+import multiprocessing
 import time
 import warnings
+from concurrent.futures import ProcessPoolExecutor
 
 warnings.filterwarnings("ignore")
 
@@ -44,12 +53,16 @@ warnings.filterwarnings("ignore")
 BASE_PATH = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 DATA_RAW = os.path.join(BASE_PATH, 'data', 'raw', 'enem')
 DATA_PROCESSED = os.path.join(BASE_PATH, 'data', 'processed')
+DATA_CACHE = os.path.join(BASE_PATH, 'data', 'cache')
 REPORT_XLSX = os.path.join(BASE_PATH, 'reports', 'varcog', 'xlsx')
 LOG_DIR = os.path.join(BASE_PATH, 'logs')
 
-for p in [DATA_RAW, DATA_PROCESSED, REPORT_XLSX, LOG_DIR]:
+for p in [DATA_RAW, DATA_PROCESSED, DATA_CACHE, REPORT_XLSX, LOG_DIR]:
     os.makedirs(p, exist_ok=True)
 
+# Leituras de 8 MiB sobre o ZipExtFile: menos chamadas pequenas de inflate por chunk do CSV
+ZIP_READ_BUFFER = 8 << 20
+
 TARGET_COLS = {
     'UF': ['SG_UF_PROVA', 'UF_PROVA', 'SG_UF_RESIDENCIA'],
     'SCHOOL_ID': ['CO_ESCOLA', 'ID_ESCOLA'],
@@ -69,6 +82,11 @@ UF_REGION_MAP = {
     'PR': 'Sul', 'SC': 'Sul', 'RS': 'Sul',
     'MS': 'Centro-Oeste', 'MT': 'Centro-Oeste', 'GO': 'Centro-Oeste', 'DF': 'Centro-Oeste'
 }
+# Dicionário fixo das 27 UFs: códigos da categoria idênticos em todos os chunks
+UF_DTYPE = pd.CategoricalDtype(list(UF_REGION_MAP))
+# Região por código de UF: consulta indexada num array pré-calculado, sem dict.map por linha
+REGION_DTYPE = pd.CategoricalDtype(list(dict.fromkeys(UF_REGION_MAP.values())))
+UF_REGION_CODES = REGION_DTYPE.categories.get_indexer(list(UF_REGION_MAP.values()))
 
 # --- WINDOWS TIMEOUT INPUT UTILITY ---
 try:
@@ -95,6 +113,11 @@ except ImportError:
         res = input(f"{prompt} [Enter para Padrão {default}]: ").strip()
         return res if res else default
 
+# Mapa do cabeçalho em caixa alta, calculado uma vez por cabeçalho (tupla) e reutilizado em cada busca
+@functools.lru_cache(maxsize=8)
+def header_index(header):
+    return {h.upper(): h for h in header}
+
 class EnemPipeline:
     def __init__(self, year, file_path, filter_choice, user_cols=None):
         self.year = year
@@ -103,105 +126,171 @@ class EnemPipeline:
         self.user_cols = user_cols # Lista de colunas desejadas
 
     def get_largest_csv(self, z):
-        csv_files = [f for f in z.namelist() if f.lower().endswith('.csv')]
-        return sorted(csv_files, key=lambda x: z.getinfo(x).file_size, reverse=True)[0] if csv_files else None
+        csv_files = [i for i in z.infolist() if i.filename.lower().endswith('.csv')]
+        return max(csv_files, key=lambda i: i.file_size) if csv_files else None
 
     def find_col_flexible(self, header, candidates):
-        header_upper = {h.upper(): h for h in header}
+        header_upper = header_index(tuple(header))
         for cand in candidates:
             if cand.upper() in header_upper: return header_upper[cand.upper()]
         return None
 
+    def open_batches(self, stack):
+        """
+        Lotes Arrow com colunas já renomeadas para os nomes padrão. Usa o cache Parquet do ano quando ele
+        é mais novo que o ZIP; senão lê o CSV do ZIP e grava o cache em paralelo (zstd) para as próximas execuções.
+        Retorna (colunas presentes, iterador de lotes).
+        """
+        cache_path = os.path.join(DATA_CACHE, f"enem_unified_{self.year}.parquet")
+        if os.path.exists(cache_path) and os.path.getmtime(cache_path) > os.path.getmtime(self.file_path):
+            pf = stack.enter_context(pq.ParquetFile(cache_path))
+            names = pf.schema_arrow.names
+            # Só reaproveita um cache com o esquema deste pipeline (nomes padrão de TARGET_COLS, UF obrigatória)
+            if 'UF' in names and set(names) <= set(TARGET_COLS):
+                print("   [CACHE] Cache Parquet reaproveitado (ZIP não é lido).")
+                return names, pf.iter_batches(batch_size=1 << 20)
+            print("   [AVISO] Cache Parquet com esquema inesperado; relendo o ZIP.")
+
+        z = stack.enter_context(zipfile.ZipFile(self.file_path, 'r'))
+        f = stack.enter_context(io.BufferedReader(z.open(self.get_largest_csv(z)), buffer_size=ZIP_READ_BUFFER))
+        # Cabeçalho espiado no buffer (peek): nada é consumido nem o membro do zip é reaberto/rebobinado
+        first_line = f.peek(1 << 16).split(b'\n', 1)[0].decode('latin1').rstrip('\r')
+        sep = ';' if first_line.count(';') > first_line.count(',') else ','
+        header = tuple(h.strip().strip('"') for h in first_line.split(sep))
+
+        col_map = {found: k for k, v in TARGET_COLS.items() if (found := self.find_col_flexible(header, v))}
+        # Leitor CSV do Arrow em lotes de 64 MiB (tokenização/conversão multithread) com tipos fixados por coluna:
+        # notas float32, situação de conclusão int8 e UF codificada em dicionário (chega ao pandas como categoria)
+        col_types = {raw: pa.dictionary(pa.int32(), pa.string()) if std == 'UF' else pa.float64() if std == 'SCHOOL_ID'
+                     else pa.int8() if std == 'STATUS' else pa.float32() for raw, std in col_map.items()}
+        reader = pacsv.open_csv(
+            f,
+            read_options=pacsv.ReadOptions(encoding='latin1', block_size=64 << 20),
+            parse_options=pacsv.ParseOptions(delimiter=sep),
+            convert_options=pacsv.ConvertOptions(include_columns=list(col_map), column_types=col_types)
+        )
+        names = [col_map[n] for n in reader.schema.names]
+        schema = pa.schema([field.with_name(n) for field, n in zip(reader.schema, names)])
+        tmp_path = cache_path + '.part'
+
+        def batches():
+            with pq.ParquetWriter(tmp_path, schema, compression='zstd') as writer:
+                for batch in reader:
+                    batch = pa.RecordBatch.from_arrays(batch.columns, names=names)
+                    writer.write_batch(batch)
+                    yield batch
+            # Só publica o cache depois de o arquivo inteiro ter sido lido
+            os.replace(tmp_path, cache_path)
+
+        return names, batches()
+
     def process(self):
         print(f"\n[INÍCIO] Processando ENEM {self.year}...")
         try:
-            with zipfile.ZipFile(self.file_path, 'r') as z:
-                target_filename = self.get_largest_csv(z)
-                with z.open(target_filename) as f:
-                    first_line = f.readline().decode('latin1')
-                    sep = ';' if first_line.count(';') > first_line.count(',') else ','
-                    f.seek(0)
-                    header = pd.read_csv(f, sep=sep, encoding='latin1', nrows=0).columns.tolist()
-                    
-                    col_map = {self.find_col_flexible(header, v): k for k, v in TARGET_COLS.items() if self.find_col_flexible(header, v)}
-                    
-                    modes = []
-                    if self.filter_choice in ['STRICT', 'BOTH'] and 'STATUS' in col_map.values(): modes.append('STRICT')
-                    if self.filter_choice in ['PROXY', 'BOTH'] and 'SCHOOL_ID' in col_map.values(): modes.append('PROXY')
+            with contextlib.ExitStack() as stack:
+                present, batches = self.open_batches(stack)
+
+                modes = []
+                if self.filter_choice in ['STRICT', 'BOTH'] and 'STATUS' in present: modes.append('STRICT')
+                if self.filter_choice in ['PROXY', 'BOTH'] and 'SCHOOL_ID' in present: modes.append('PROXY')
+
+                if not modes:
+                    print(f"   [AVISO] Filtros não suportados para {self.year}.")
+                    return
+
+                # Passada única pelo arquivo: cada chunk alimenta todos os filtros selecionados
+                print(f"   -> Executando Filtro: {', '.join(modes)}")
+                score_cols = ['CN', 'CH', 'LC', 'MT', 'RED']
+
+                # Acumulador pré-alocado por filtro: matriz [27 UFs x (notas + Média_Geral + N_Alunos)] indexada pelo código da UF
+                valid_scores = [c for c in score_cols if c in present]
+                agg_cols = pd.MultiIndex.from_product([valid_scores + ['Média_Geral', 'N_Alunos'], ['sum']])
+                agg_sums = {mode: np.zeros((len(UF_DTYPE.categories), len(agg_cols))) for mode in modes}
 
-                    if not modes:
-                        print(f"   [AVISO] Filtros não suportados para {self.year}.")
-                        return
+                for batch in batches:
+                    chunk = batch.to_pandas()
+                    codes = chunk['UF'].astype(UF_DTYPE).cat.codes.to_numpy()
+
+                    # Bloco contíguo float32 (tipo fixado na leitura): notas, média por aluno (np.nanmean) e contagem,
+                    # montado uma única vez por chunk e reaproveitado por todos os filtros
+                    vals = np.empty((len(chunk), len(valid_scores) + 2), dtype=np.float32)
+                    arr = vals[:, :len(valid_scores)]
+                    arr[:] = chunk[valid_scores].to_numpy(dtype=np.float32)
+                    vals[:, -2] = np.nanmean(arr, axis=1)
+                    vals[:, -1] = 1.0
+                    np.nan_to_num(vals, copy=False)
 
                     for mode in modes:
-                        print(f"   -> Executando Filtro: {mode}")
-                        f.seek(0)
-                        reader = pd.read_csv(f, sep=sep, encoding='latin1', usecols=list(col_map.keys()), chunksize=500000)
-                        agg_storage = []
-                        score_cols = ['CN', 'CH', 'LC', 'MT', 'RED']
-
-                        for chunk in reader:
-                            chunk = chunk.rename(columns=col_map)
-                            chunk = chunk[chunk['STATUS'] == 2].copy() if mode == 'STRICT' else chunk[chunk['SCHOOL_ID'].notna()].copy()
-                            if chunk.empty: continue
-                            
-                            valid_scores = [c for c in score_cols if c in chunk.columns]
-                            chunk[valid_scores] = chunk[valid_scores].apply(pd.to_numeric, errors='coerce')
-                            chunk['Média_Geral'] = chunk[valid_scores].mean(axis=1)
-                            chunk['N_Alunos'] = 1 
-                            
-                            agg_chunk = chunk.groupby('UF')[valid_scores + ['Média_Geral', 'N_Alunos']].agg(['sum'])
-                            agg_storage.append(agg_chunk)
-
-                        full_agg = pd.concat(agg_storage).groupby(level=0).sum()
-                        final_df = pd.DataFrame(index=full_agg.index)
-                        total_n = full_agg[('N_Alunos', 'sum')]
-                        
-                        for col in full_agg.columns.levels[0]:
-                            final_df[col] = full_agg[(col, 'sum')] if col == 'N_Alunos' else full_agg[(col, 'sum')] / total_n
-
-                        final_df = final_df.reset_index()
-                        final_df['Região'] = final_df['UF'].map(UF_REGION_MAP)
-                        final_df['Ano'] = self.year
-                        final_df['Filtro'] = f"{mode}_3EM"
-                        
-                        rename_dict = {
-                            'CN': 'Ciências_Natureza', 'CH': 'Ciências_Humanas', 
-                            'LC': 'Linguagens', 'MT': 'Matemática', 'RED': 'Redação'
-                        }
-                        final_df = final_df.rename(columns=rename_dict)
-                        
-                        # --- FILTRAGEM DE COLUNAS (NOVA FEATURE) ---
-                        all_cols_ptbr = ['Ano', 'Região', 'UF', 'Filtro', 'Média_Geral', 'N_Alunos'] + [rename_dict[c] for c in score_cols if c in rename_dict]
-                        
-                        # Se o usuário definiu colunas, fazemos a intersecção
-                        if self.user_cols:
-                            # Normaliza para garantir match (strip)
-                            cols_to_keep = [c for c in all_cols_ptbr if c in self.user_cols]
-                            # Se não sobrou nada (erro de digitação), volta para o padrão
-                            if not cols_to_keep: 
-                                cols_to_keep = all_cols_ptbr
-                        else:
+                        keep = (chunk['STATUS'] == 2).to_numpy() if mode == 'STRICT' else chunk['SCHOOL_ID'].notna().to_numpy()
+                        keep &= codes >= 0
+                        if not keep.any(): continue
+                        # Scatter-add direto nos códigos da UF
+                        np.add.at(agg_sums[mode], codes[keep], vals[keep])
+
+                for mode in modes:
+                    full_agg = pd.DataFrame(agg_sums[mode], index=pd.Index(UF_DTYPE.categories, name='UF'), columns=agg_cols)
+                    full_agg = full_agg[full_agg[('N_Alunos', 'sum')] > 0]
+                    if full_agg.empty: continue
+                    final_df = pd.DataFrame(index=full_agg.index)
+                    total_n = full_agg[('N_Alunos', 'sum')]
+                    
+                    for col in full_agg.columns.levels[0]:
+                        final_df[col] = full_agg[(col, 'sum')].astype('int64') if col == 'N_Alunos' else full_agg[(col, 'sum')] / total_n
+
+                    final_df = final_df.reset_index()
+                    final_df['Região'] = pd.Categorical.from_codes(UF_REGION_CODES[final_df['UF'].astype(UF_DTYPE).cat.codes], dtype=REGION_DTYPE)
+                    final_df['Ano'] = self.year
+                    final_df['Filtro'] = f"{mode}_3EM"
+                    
+                    rename_dict = {
+                        'CN': 'Ciências_Natureza', 'CH': 'Ciências_Humanas', 
+                        'LC': 'Linguagens', 'MT': 'Matemática', 'RED': 'Redação'
+                    }
+                    final_df = final_df.rename(columns=rename_dict)
+                    
+                    # --- FILTRAGEM DE COLUNAS (NOVA FEATURE) ---
+                    all_cols_ptbr = ['Ano', 'Região', 'UF', 'Filtro', 'Média_Geral', 'N_Alunos'] + [rename_dict[c] for c in score_cols if c in rename_dict]
+                    
+                    # Se o usuário definiu colunas, fazemos a intersecção
+                    if self.user_cols:
+                        # Normaliza para garantir match (strip)
+                        cols_to_keep = [c for c in all_cols_ptbr if c in self.user_cols]
+                        # Se não sobrou nada (erro de digitação), volta para o padrão
+                        if not cols_to_keep: 
                             cols_to_keep = all_cols_ptbr
+                    else:
+                        cols_to_keep = all_cols_ptbr
 
-                        final_df = final_df[cols_to_keep]
-                        # Tenta ordenar por Média_Geral se ela existir na seleção
-                        if 'Média_Geral' in final_df.columns:
-                            final_df = final_df.sort_values('Média_Geral', ascending=False)
-                        
-                        fname = f"enem_table_{self.year}_{mode}_3EM"
-                        final_df.to_csv(os.path.join(DATA_PROCESSED, f"{fname}.csv"), index=False)
-                        final_df.to_excel(os.path.join(REPORT_XLSX, f"{fname}.xlsx"), index=False)
-                        
-                        # Log seguro caso N_Alunos tenha sido removido da seleção
-                        n_count = int(total_n.sum()) # Pega do total bruto
-                        print(f"      [OK] Gerado: {fname} | N: {n_count}")
+                    final_df = final_df[cols_to_keep]
+                    # Tenta ordenar por Média_Geral se ela existir na seleção
+                    if 'Média_Geral' in final_df.columns:
+                        final_df = final_df.sort_values('Média_Geral', ascending=False)
+                    
+                    fname = f"enem_table_{self.year}_{mode}_3EM"
+                    # Uma única tabela Arrow alimenta o escritor CSV em C++ e a cópia colunar
+                    # (o painel prioriza o irmão .parquet)
+                    table = pa.Table.from_pandas(final_df, preserve_index=False)
+                    pacsv.write_csv(table, os.path.join(DATA_PROCESSED, f"{fname}.csv"),
+                                    write_options=pacsv.WriteOptions(quoting_style='none'))
+                    pq.write_table(table, os.path.join(DATA_PROCESSED, f"{fname}.parquet"), compression='zstd')
+                    with pd.ExcelWriter(os.path.join(REPORT_XLSX, f"{fname}.xlsx"), engine='xlsxwriter') as writer:
+                        final_df.to_excel(writer, index=False)
+                    
+                    # Log seguro caso N_Alunos tenha sido removido da seleção
+                    n_count = int(total_n.sum()) # Pega do total bruto
+                    print(f"      [OK] Gerado: {fname} | N: {n_count}")
 
         except Exception as e:
             print(f"   [ERRO] {e}")
 
+def run_year(task):
+    """Worker: processa um ano (top-level para ser serializável pelo ProcessPoolExecutor)."""
+    year, path, filter_choice, user_cols = task
+    EnemPipeline(year, path, filter_choice, user_cols).process()
+
 def main():
-    os.system('cls' if os.name == 'nt' else 'clear')
+    if os.name == 'nt': os.system('')  # habilita sequências ANSI no console do Windows
+    print('\033[2J\033[H', end='', flush=True)
     print("=== ENEM UNIFIED PIPELINE v4.0 ===")
     
     # 1. Anos
@@ -235,13 +324,23 @@ def main():
     
     print("-" * 60)
 
+    tasks = []
     for y in years:
         path = os.path.join(DATA_RAW, f"microdados_enem_{y}.zip")
         if os.path.exists(path):
-            EnemPipeline(y, path, selected_filter, user_cols_list).process()
+            tasks.append((y, path, selected_filter, user_cols_list))
         else:
             print(f"[PULAR] Faltando: {path}")
 
+    # Anos são independentes (ZIP e saídas próprios): um processo por ano.
+    # O leitor CSV do Arrow já é multithread, então os workers ficam em metade dos núcleos (sem sobreinscrição).
+    if len(tasks) > 1:
+        workers = min(len(tasks), max(1, (os.cpu_count() or 1) // 2))
+        with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context('spawn')) as ex:
+            list(ex.map(run_year, tasks))
+    else:
+        for task in tasks: run_year(task)
+
     print("\n[CONCLUÍDO] Processos finalizados.")
 
 if __name__ == "__main__":
@@ -19,24 +19,33 @@ ABSTRACT:
     - Network Filtering (Public/Private/All).
     - Student Count (N) Extraction.
     - Full PT-BR Output.
+    - Independent years processed in parallel (one process per year).
 
 RASTREABILITY SETTINGS:
     - INPUT_ROOT:  data/raw/saeb/
     - OUTPUT_CSV:  data/processed/saeb_table_[year]_[grade].csv
+    - OUTPUT_PQ:   data/processed/saeb_table_[year]_[grade].parquet
     - LOG_FILE:    logs/saeb_pipeline_[year].log
+    - CACHE:       data/cache/saeb_[year].schema.json (detected layout, keyed by ZIP size + mtime)
+    - TMP:         data/tmp/saeb_[year]_TS_ESCOLA.csv (extracted member, reused while newer than ZIP)
 
 DEPENDENCIES:
-    pandas, numpy, zipfile, logging, os
+    polars, xlsxwriter, zipfile, logging, os, concurrent.futures
 ================================================================================
 """
 
-import pandas as pd
-import numpy as np
+import polars as pl
+import xlsxwriter
 import os
+import json
+import shutil
 import zipfile
 import logging
+import multiprocessing
 import time
+import threading
 import warnings
+from concurrent.futures import ProcessPoolExecutor
 
 warnings.filterwarnings("ignore")
 
@@ -46,8 +55,10 @@ DATA_RAW = os.path.join(BASE_PATH, 'data', 'raw', 'saeb')
 DATA_PROCESSED = os.path.join(BASE_PATH, 'data', 'processed')
 REPORT_XLSX = os.path.join(BASE_PATH, 'reports', 'varcog', 'xlsx') 
 LOG_DIR = os.path.join(BASE_PATH, 'logs')
+DATA_CACHE = os.path.join(BASE_PATH, 'data', 'cache')
+DATA_TMP = os.path.join(BASE_PATH, 'data', 'tmp')
 
-for p in [DATA_RAW, DATA_PROCESSED, LOG_DIR, REPORT_XLSX]: 
+for p in [DATA_RAW, DATA_PROCESSED, LOG_DIR, REPORT_XLSX, DATA_CACHE, DATA_TMP]: 
     os.makedirs(p, exist_ok=True)
 
 IBGE_TO_SIGLA = {
@@ -57,6 +68,9 @@ IBGE_TO_SIGLA = {
     50:'MS', 51:'MT', 52:'GO', 53:'DF'
 }
 
+# Dicionário fixo das 27 UFs: o group_by opera sobre códigos inteiros, não strings
+UF_ENUM = pl.Enum(list(IBGE_TO_SIGLA.values()))
+
 UF_REGION_MAP = {
     'RO': 'Norte', 'AC': 'Norte', 'AM': 'Norte', 'RR': 'Norte', 'PA': 'Norte', 'AP': 'Norte', 'TO': 'Norte',
     'MA': 'Nordeste', 'PI': 'Nordeste', 'CE': 'Nordeste', 'RN': 'Nordeste', 'PB': 'Nordeste', 
@@ -66,6 +80,15 @@ UF_REGION_MAP = {
     'MS': 'Centro-Oeste', 'MT': 'Centro-Oeste', 'GO': 'Centro-Oeste', 'DF': 'Centro-Oeste'
 }
 
+def write_xlsx(df, path):
+    """Grava o DataFrame Polars via xlsxwriter (constant_memory), uma chamada write_row por linha."""
+    wb = xlsxwriter.Workbook(path, {'constant_memory': True})
+    ws = wb.add_worksheet()
+    ws.write_row(0, 0, df.columns)
+    for i, row in enumerate(df.iter_rows(), 1):
+        ws.write_row(i, 0, row)
+    wb.close()
+
 # --- WINDOWS TIMEOUT INPUT UTILITY ---
 try:
     import msvcrt
@@ -121,104 +144,214 @@ class SaebPipeline:
             if not qty: qty = self.get_quantity_column(header, "EM")
         return lp, mt, qty
 
+    def probe_schema(self, z):
+        """Detecta membro TS_ESCOLA, separador e colunas a partir de uma amostra de 64 KB."""
+        target = next((i for i in z.infolist() if 'TS_ESCOLA' in i.filename and i.filename.endswith('.csv')), None)
+        if not target: return None
+
+        with z.open(target) as f:
+            sample = f.read(1 << 16).decode('latin1')
+        first_line = sample.partition('\n')[0]
+        sep = ';' if first_line.count(';') > first_line.count(',') else ','
+        header = [h.strip().strip('"') for h in first_line.rstrip('\r').split(sep)]
+
+        grade_cols = {}
+        for grade in ['9EF', '3EM']:
+            c_lp, c_mt, c_qty = self.find_grade_columns(header, grade)
+            if c_lp and c_mt: grade_cols[grade] = [c_lp, c_mt, c_qty]
+
+        return {
+            'member': target.filename,
+            'sep': sep,
+            'col_adm': next((h for h in header if any(x in h.upper() for x in ['ID_DEPENDENCIA_ADM', 'IN_PUBLICA', 'ID_REDE', 'TP_DEPENDENCIA'])), None),
+            'col_uf': next((h for h in header if any(x in h.upper() for x in ['ID_UF', 'CO_UF', 'UF', 'SG_UF'])), None),
+            'grade_cols': grade_cols
+        }
+
+    def load_schema(self, z):
+        """Esquema detectado em cache (data/cache/saeb_[ano].schema.json), validado por tamanho e mtime do ZIP."""
+        key = f"{os.path.getsize(self.file_path)}:{int(os.path.getmtime(self.file_path))}"
+        cache_path = os.path.join(DATA_CACHE, f"saeb_{self.year}.schema.json")
+        if os.path.exists(cache_path):
+            try:
+                with open(cache_path, encoding='utf-8') as fh:
+                    cached = json.load(fh)
+                if cached.get('key') == key:
+                    print("   [CACHE] Esquema reutilizado.")
+                    return cached['schema']
+            except (OSError, ValueError, KeyError):
+                pass
+
+        schema = self.probe_schema(z)
+        if schema:
+            with open(cache_path, 'w', encoding='utf-8') as fh:
+                json.dump({'key': key, 'schema': schema}, fh, ensure_ascii=False, indent=2)
+        return schema
+
+    def extract_member(self, z, target):
+        """Extrai TS_ESCOLA uma vez para data/tmp e reaproveita enquanto for mais novo que o ZIP."""
+        out_path = os.path.join(DATA_TMP, f"saeb_{self.year}_{os.path.basename(target.filename)}")
+        if os.path.exists(out_path) and os.path.getmtime(out_path) > os.path.getmtime(self.file_path):
+            print("   [CACHE] CSV extraído reutilizado.")
+            return out_path
+
+        tmp_path = out_path + '.part'
+        with z.open(target) as src, open(tmp_path, 'wb') as dst:
+            shutil.copyfileobj(src, dst, length=16 << 20)
+        os.replace(tmp_path, out_path)
+        return out_path
+
     def process(self):
         print(f"\n[INÍCIO] Processando SAEB {self.year}...")
         try:
             with zipfile.ZipFile(self.file_path, 'r') as z:
-                target = next((f for f in z.namelist() if 'TS_ESCOLA' in f and f.endswith('.csv')), None)
-                if not target:
+                schema = self.load_schema(z)
+                if not schema:
                     print(f"   [ERRO] TS_ESCOLA não encontrado no ZIP.")
                     return
 
-                with z.open(target) as f:
-                    first_line = f.readline().decode('latin1')
-                    sep = ';' if first_line.count(';') > first_line.count(',') else ','
-                    f.seek(0)
-                    header = pd.read_csv(f, sep=sep, encoding='latin1', nrows=0).columns.tolist()
-                    
-                    col_adm = next((h for h in header if any(x in h.upper() for x in ['ID_DEPENDENCIA_ADM', 'IN_PUBLICA', 'ID_REDE', 'TP_DEPENDENCIA'])), None)
-                    col_uf = next((h for h in header if any(x in h.upper() for x in ['ID_UF', 'CO_UF', 'UF', 'SG_UF'])), None)
-
-                    processed_grades = 0
-                    for grade in ['9EF', '3EM']:
-                        c_lp, c_mt, c_qty = self.find_grade_columns(header, grade)
-                        if not (c_lp and c_mt): continue 
-
-                        f.seek(0)
-                        cols = [c for c in [col_uf, col_adm, c_lp, c_mt, c_qty] if c]
-                        df = pd.read_csv(f, sep=sep, encoding='latin1', usecols=cols)
-
-                        # 1. Filtro de Rede
-                        if col_adm:
-                            df['TEMP_ADM'] = pd.to_numeric(df[col_adm], errors='coerce')
-                            df['Is_Public'] = df['TEMP_ADM'].apply(lambda x: 0 if x == 4 else 1)
-                        else:
-                            df['Is_Public'] = 1
-                        
-                        if self.filter_network == 'PUBLIC': df = df[df['Is_Public'] == 1]
-                        elif self.filter_network == 'PRIVATE': df = df[df['Is_Public'] == 0]
-
-                        # 2. Normalização
-                        df['UF'] = df[col_uf].map(IBGE_TO_SIGLA) if pd.api.types.is_numeric_dtype(df[col_uf]) else df[col_uf]
-                        
-                        for c in [c_lp, c_mt]:
-                            df[c] = pd.to_numeric(df[c].astype(str).str.replace(',', '.'), errors='coerce')
-                        
-                        df['N_Alunos'] = pd.to_numeric(df[c_qty], errors='coerce').fillna(0) if c_qty else 0
-                        
-                        # 3. Agregação
-                        sub = df.dropna(subset=[c_lp, c_mt]).copy()
-                        if sub.empty: continue
-
-                        # Média Ponderada pelo N da Escola (Importante para SAEB)
-                        # Nota: Se N_Alunos for 0 (dados faltantes), usa média simples
-                        if sub['N_Alunos'].sum() > 0:
-                            agg = sub.groupby('UF').apply(
-                                lambda x: pd.Series({
-                                    'Média_Port': np.average(x[c_lp], weights=x['N_Alunos']) if x['N_Alunos'].sum() > 0 else x[c_lp].mean(),
-                                    'Média_Mat': np.average(x[c_mt], weights=x['N_Alunos']) if x['N_Alunos'].sum() > 0 else x[c_mt].mean(),
-                                    'N_Alunos': x['N_Alunos'].sum()
-                                })
-                            ).reset_index()
-                        else:
-                            agg = sub.groupby('UF').agg({c_lp: 'mean', c_mt: 'mean', 'N_Alunos': 'sum'}).reset_index()
-                            agg.rename(columns={c_lp: 'Média_Port', c_mt: 'Média_Mat'}, inplace=True)
-
-                        agg['Média_Geral'] = (agg['Média_Port'] + agg['Média_Mat']) / 2
-                        agg['Região'] = agg['UF'].map(UF_REGION_MAP)
-                        agg['Ano'] = self.year
-                        agg['Série'] = grade
-                        agg['Rede'] = self.filter_network
-
-                        # 4. Seleção de Colunas Dinâmica
-                        all_cols = ['Ano', 'Região', 'UF', 'Rede', 'Série', 'Média_Geral', 'Média_Mat', 'Média_Port', 'N_Alunos']
-                        
-                        if self.user_cols:
-                            cols_to_keep = [c for c in all_cols if c in self.user_cols]
-                            if not cols_to_keep: cols_to_keep = all_cols
-                        else:
-                            cols_to_keep = all_cols
-
-                        # Ordenação
-                        final_df = agg[cols_to_keep]
-                        if 'Média_Geral' in final_df.columns:
-                            final_df = final_df.sort_values('Média_Geral', ascending=False)
-                        
-                        # 5. Output
-                        base_name = f"saeb_table_{self.year}_{grade}"
-                        final_df.to_csv(os.path.join(DATA_PROCESSED, f"{base_name}.csv"), index=False)
-                        final_df.to_excel(os.path.join(REPORT_XLSX, f"{base_name}.xlsx"), index=False)
-                        print(f"   -> Gerado: {base_name} | Alunos: {int(agg['N_Alunos'].sum())}")
-                        processed_grades += 1
-                    
-                    if processed_grades == 0:
-                        print("   [AVISO] Nenhuma série processada (verifique filtros ou arquivo).")
+                target = z.getinfo(schema['member'])
+                sep = schema['sep']
+                # Com ';' a vírgula decimal é tratada sempre: a troca ',' -> '.' aceita as duas formas,
+                # sem depender de uma amostra (nem de um palpite antigo guardado no cache do esquema)
+                decimal = ',' if sep == ';' else '.'
+                col_adm, col_uf = schema['col_adm'], schema['col_uf']
+                grade_cols = {grade: tuple(cols) for grade, cols in schema['grade_cols'].items()}
+                if not grade_cols:
+                    print("   [AVISO] Nenhuma série processada (verifique filtros ou arquivo).")
+                    return
+
+                if self.filter_network == 'PRIVATE' and not col_adm:
+                    print("   [AVISO] Sem coluna de dependência administrativa: filtro PRIVATE indisponível.")
+                    return
+
+                csv_path = self.extract_member(z, target)
+
+            # Varredura lazy do CSV extraído: projeção (só as colunas das séries) e o filtro de rede
+            # são empurrados para o leitor multithread do Polars; notas chegam como float32.
+            score_cols = [c for c_lp, c_mt, _ in grade_cols.values() for c in (c_lp, c_mt)]
+            qty_cols = [c_qty for _, _, c_qty in grade_cols.values() if c_qty]
+            use_cols = list(dict.fromkeys(c for c in [col_uf, col_adm] + [c for cols in grade_cols.values() for c in cols] if c))
+            casts = {c: pl.Float32 for c in score_cols}
+            casts.update({c: pl.Float64 for c in qty_cols})
+            if col_adm: casts[col_adm] = pl.Float32
+
+            def to_num(c, dtype):
+                # Lido como texto e convertido sem strict: célula inválida vira nulo (como pd.to_numeric(errors='coerce'))
+                x = pl.col(c).str.strip_chars()
+                if decimal == ',': x = x.str.replace(',', '.', literal=True)
+                return x.cast(dtype, strict=False)
+
+            lf = pl.scan_csv(
+                csv_path, separator=sep, encoding='utf8-lossy',
+                schema_overrides={c: pl.String for c in casts}, null_values=['', 'NA']
+            ).select(use_cols).with_columns([to_num(c, t) for c, t in casts.items()])
+            if col_adm and self.filter_network in ('PUBLIC', 'PRIVATE'):
+                # Código 4 = privada; ausente conta como pública
+                is_private = (pl.col(col_adm) == 4).fill_null(False)
+                lf = lf.filter(is_private if self.filter_network == 'PRIVATE' else ~is_private)
+            raw = lf.collect(engine='streaming')
+
+            uf_is_code = raw.schema[col_uf].is_numeric()
+            w = pl.col('N_Alunos')
+            def weighted(c):
+                # Notas ficam em float32 (metade da banda); as somas acumulam em float64
+                x = pl.col(c).cast(pl.Float64)
+                return pl.when(w.sum() > 0).then((x * w).sum() / w.sum()).otherwise(x.mean())
+
+            # 1. Normalização (filtro de rede já aplicado na leitura)
+            # Formato longo: um bloco (Série, UF, LP, MT, N) por série, empilhados num único plano
+            uf = pl.col(col_uf).replace_strict(IBGE_TO_SIGLA, default=None, return_dtype=UF_ENUM) if uf_is_code else pl.col(col_uf).cast(pl.Utf8).str.strip_chars().cast(UF_ENUM, strict=False)
+            long = pl.concat([
+                raw.lazy().select(
+                    pl.lit(grade).alias('Série'),
+                    uf.alias('UF'),
+                    pl.col(c_lp).alias('LP'),
+                    pl.col(c_mt).alias('MT'),
+                    (pl.col(c_qty).cast(pl.Float64, strict=False).fill_null(0) if c_qty else pl.lit(0.0)).alias('N_Alunos')
+                )
+                for grade, (c_lp, c_mt, c_qty) in grade_cols.items()
+            ]).drop_nulls(['UF', 'LP', 'MT'])
+
+            # 2. Agregação (um único group_by por Série x UF)
+            # Média Ponderada pelo N da Escola (Importante para SAEB)
+            # Nota: Se N_Alunos for 0 (dados faltantes), usa média simples
+            agg_all = (
+                long.group_by(['Série', 'UF'])
+                .agg(weighted('LP').alias('Média_Port'), weighted('MT').alias('Média_Mat'), w.sum().alias('N_Alunos'))
+                .with_columns(
+                    ((pl.col('Média_Port') + pl.col('Média_Mat')) / 2).alias('Média_Geral'),
+                    pl.col('UF').cast(pl.Utf8).replace_strict(UF_REGION_MAP, default=None).alias('Região'),
+                    pl.lit(self.year).alias('Ano'),
+                    pl.lit(self.filter_network).alias('Rede')
+                )
+                .collect(engine='streaming')
+            )
+            del raw
+
+            processed_grades = 0
+            writers = []
+            for grade in grade_cols:
+                agg = agg_all.filter(pl.col('Série') == grade)
+                if agg.is_empty(): continue
+
+                # 3. Seleção de Colunas Dinâmica
+                all_cols = ['Ano', 'Região', 'UF', 'Rede', 'Série', 'Média_Geral', 'Média_Mat', 'Média_Port', 'N_Alunos']
+                
+                if self.user_cols:
+                    cols_to_keep = [c for c in all_cols if c in self.user_cols]
+                    if not cols_to_keep: cols_to_keep = all_cols
+                else:
+                    cols_to_keep = all_cols
+
+                # Ordenação
+                final_df = agg.select(cols_to_keep)
+                if 'Média_Geral' in final_df.columns:
+                    final_df = final_df.sort('Média_Geral', descending=True)
+                
+                # 4. Output
+                base_name = f"saeb_table_{self.year}_{grade}"
+                final_df.write_csv(os.path.join(DATA_PROCESSED, f"{base_name}.csv"))
+                final_df.write_parquet(os.path.join(DATA_PROCESSED, f"{base_name}.parquet"), compression='zstd', compression_level=9)
+                # XLSX em thread de fundo: sobrepõe a escrita com as saídas da próxima série
+                xlsx_thread = threading.Thread(
+                    target=write_xlsx,
+                    args=(final_df, os.path.join(REPORT_XLSX, f"{base_name}.xlsx"))
+                )
+                xlsx_thread.start()
+                writers.append(xlsx_thread)
+                print(f"   -> Gerado: {base_name} | Alunos: {int(agg['N_Alunos'].sum())}")
+                processed_grades += 1
+            
+            for t in writers: t.join()
+
+            if processed_grades == 0:
+                print("   [AVISO] Nenhuma série processada (verifique filtros ou arquivo).")
 
         except Exception as e:
             print(f"   [ERRO] {e}")
 
+def run_year(task):
+    """Worker: processa um ano (top-level para ser serializável pelo ProcessPoolExecutor)."""
+    year, path, filter_network, user_cols = task
+    # Log por ano (logs/saeb_pipeline_[ano].log): processos paralelos nunca disputam o mesmo arquivo
+    logger = logging.getLogger(f"saeb.{year}")
+    logger.setLevel(logging.INFO)
+    handler = logging.FileHandler(os.path.join(LOG_DIR, f"saeb_pipeline_{year}.log"), encoding='utf-8')
+    handler.setFormatter(logging.Formatter('%(asctime)s [%(process)d] %(levelname)s %(message)s'))
+    logger.addHandler(handler)
+    try:
+        logger.info(f"Início | arquivo={os.path.basename(path)} | rede={filter_network}")
+        start = time.perf_counter()
+        SaebPipeline(year, path, filter_network, user_cols).process()
+        logger.info(f"Fim | {time.perf_counter() - start:.1f}s")
+    finally:
+        logger.removeHandler(handler)
+        handler.close()
+
 def main():
-    os.system('cls' if os.name == 'nt' else 'clear')
+    if os.name == 'nt': os.system('')  # habilita sequências ANSI no console do Windows
+    print('\033[2J\033[H', end='', flush=True)
     print("=== SAEB UNIFIED PIPELINE v14.7 ===")
     
     # 1. Anos
@@ -251,18 +384,32 @@ def main():
     
     print("-" * 60)
 
+    # Resolução dos arquivos (serial) -> processamento dos anos (paralelo)
+    tasks = []
     for y in years:
         path = os.path.join(DATA_RAW, f"microdados_saeb_{y}.zip")
         if os.path.exists(path):
-            SaebPipeline(y, path, selected_filter, user_cols_list).process()
+            tasks.append((y, path, selected_filter, user_cols_list))
         else:
             # Tenta nome alternativo comum
             path_alt = os.path.join(DATA_RAW, f"TS_ESCOLA_{y}.zip")
             if os.path.exists(path_alt):
-                SaebPipeline(y, path_alt, selected_filter, user_cols_list).process()
+                tasks.append((y, path_alt, selected_filter, user_cols_list))
             else:
                 print(f"[PULAR] Faltando: microdados_saeb_{y}.zip")
 
+    # Anos são independentes (ZIPs distintos): um processo por ano.
+    # Cada ano já usa o pool multithread do Polars, então os workers ficam em metade dos núcleos
+    # e as threads do Polars são divididas entre eles (spawn: o filho importa o Polars já com o limite).
+    if len(tasks) > 1:
+        cpus = os.cpu_count() or 1
+        workers = min(len(tasks), max(1, cpus // 2))
+        os.environ.setdefault('POLARS_MAX_THREADS', str(max(1, cpus // workers)))
+        with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context('spawn')) as ex:
+            list(ex.map(run_year, tasks))
+    else:
+        for task in tasks: run_year(task)
+
     print("\n[CONCLUÍDO] Processos SAEB finalizados.")
 
 if __name__ == "__main__":
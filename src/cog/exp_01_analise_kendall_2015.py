@@ -182,7 +182,8 @@ def plot_results(df, W, suffix):
 
 # MAIN
 if __name__ == "__main__":
-    os.system('cls' if os.name == 'nt' else 'clear')
+    if os.name == 'nt': os.system('')  # habilita sequências ANSI no console do Windows
+    print('\033[2J\033[H', end='', flush=True)
     print("=== ANÁLISE KENDALL 2015 (v3.4) ===")
     
     # MENU DE ESCOLHA
@@ -212,7 +213,8 @@ if __name__ == "__main__":
         f_xlsx = DIRS["xlsx"] / f"kendall_final_2015{target_suffix}.xlsx"
         
         df_final.to_csv(f_csv, index=False)
-        df_final.to_excel(f_xlsx, index=False)
+        with pd.ExcelWriter(f_xlsx, engine='xlsxwriter') as writer:
+            df_final.to_excel(writer, index=False)
         
         plot_results(df_final, W, target_suffix)
         print(f"[SUCESSO] Arquivos gerados com sufixo '{target_suffix}'")
\ No newline at end of file
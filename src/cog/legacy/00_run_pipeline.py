@@ -12,6 +12,7 @@ DESCRIPTION:
     [PHASE 1: EXTRACTION & PROCESSING]
     - Extracts raw data and converts to clean CSVs in 'data/processed'.
     - Covers both Historical (2015-2018) and Recent (2022-2024) waves.
+    - Extractors have no data dependencies among themselves and run concurrently.
 
     [PHASE 2: CONSOLIDATION]
     - Merges the disparate CSVs into a single Longitudinal Panel.
@@ -19,25 +20,48 @@ DESCRIPTION:
     [PHASE 3: ANALYTICS & VISUALIZATION]
     - Generates correlation matrices and final charts in 'reports/'.
     
+    Stages whose declared outputs are newer than all of their inputs are
+    skipped (Make-style incremental build). Use --force to rerun everything.
+    
+    Extractor XLSX reports are skipped unless --reports is given.
+    
+    Use --in-process to run the stages sequentially inside this interpreter
+    (runpy), paying the pandas/matplotlib import cost only once. The default
+    keeps one isolated subprocess per stage so stages can run in parallel.
+    
     WARNING: This process is memory intensive. Ensure all raw ZIPs are present.
+    Each stage's resident memory (RSS, including its own worker processes) is
+    checked every second against 85% of RAM divided by the number of parallel
+    stages and logged every 10s; a stage over budget is terminated instead of
+    pushing the machine into swap.
 """
+import argparse
+import contextlib
+import os
+import runpy
 import subprocess
 import sys
 import time
 import datetime
+import logging
+import queue
+import signal
+import threading
+import traceback
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from logging.handlers import QueueHandler, QueueListener
 from pathlib import Path
 
+import psutil
+
 # --- CONFIGURATION ---
 CURRENT_DIR = Path(__file__).resolve().parent
 PROJECT_ROOT = CURRENT_DIR.parent.parent
 LOG_DIR = PROJECT_ROOT / 'logs'
 LOG_DIR.mkdir(exist_ok=True)
 
-# List of scripts to execute in VALID LOGICAL ORDER
-PIPELINE_SCRIPTS = [
-    # ------------------------------------------------------------------
-    # PHASE 1: INDIVIDUAL EXTRACTION (Raw -> Processed CSV)
-    # ------------------------------------------------------------------
+# Phase 1 extractors (Raw -> Processed CSV). No dependencies among themselves.
+EXTRACTION_SCRIPTS = [
     "src/cog/01_process_saeb_historical.py",      # Extracts 2015 & 2017
     "src/cog/01_process_saeb_2023_uf_region.py",  # Extracts 2023
     
@@ -47,114 +71,400 @@ PIPELINE_SCRIPTS = [
     
     "src/cog/04_process_enem_historical.py",      # Extracts 2015 & 2018
     "src/cog/04_process_enem_triennium.py",       # Extracts 2022, 2023, 2024
+]
+
+CONSOLIDATION_SCRIPT = "src/cog/03_consolidate_longitudinal_panel.py"
+
+# Dependency graph {script: [scripts it depends on]}, in VALID LOGICAL ORDER
+PIPELINE_DAG = {
+    # ------------------------------------------------------------------
+    # PHASE 1: INDIVIDUAL EXTRACTION (Raw -> Processed CSV)
+    # ------------------------------------------------------------------
+    **{script: [] for script in EXTRACTION_SCRIPTS},
     
     # ------------------------------------------------------------------
     # PHASE 2: CONSOLIDATION (Processed CSVs -> Master Panel)
     # ------------------------------------------------------------------
-    "src/cog/03_consolidate_longitudinal_panel.py",
+    CONSOLIDATION_SCRIPT: list(EXTRACTION_SCRIPTS),
     
     # ------------------------------------------------------------------
     # PHASE 3: ANALYTICS & INSIGHTS (Master Panel -> Reports)
     # ------------------------------------------------------------------
-    "src/cog/05_correlate_pearson_spearman.py",
-    "src/cog/06_visualize_correlations.py"
-]
+    "src/cog/05_correlate_pearson_spearman.py": [CONSOLIDATION_SCRIPT],
+    "src/cog/06_visualize_correlations.py": [CONSOLIDATION_SCRIPT],
+}
+
+PIPELINE_SCRIPTS = list(PIPELINE_DAG)
+
+# Declared artifacts (relative to PROJECT_ROOT) for the incremental build check.
+# Stages not listed here have no declared artifacts and always run.
+RAW_DIR = 'data/raw'
+PROC_DIR = 'data/processed'
+XLSX_DIR = 'reports/varcog/xlsx'
+REPORT_PROC_DIR = 'reports/varcog/data/processed'
+IMG_DIR = 'reports/varcog/graficos'
 
-def get_log_file_handle():
-    """Creates a timestamped log file."""
+STAGE_ARTIFACTS = {
+    "src/cog/01_process_saeb_2023_uf_region.py": {
+        "inputs": [f"{RAW_DIR}/microdados_saeb_2023.zip"],
+        "outputs": [f"{PROC_DIR}/saeb_table_2023.csv", f"{IMG_DIR}/ranking_saeb_2023.png"],
+    },
+    "src/cog/02_process_pisa_2018_region.py": {
+        "inputs": [f"{RAW_DIR}/Pisa/pisa_2018/CY07_MSU_STU_QQQ.sav"],
+        # This stage writes its CSV under reports/varcog/data/processed, not data/processed
+        "outputs": [f"{REPORT_PROC_DIR}/pisa_2018_regional_summary.csv", f"{XLSX_DIR}/pisa_2018_regional_summary.xlsx"],
+    },
+    "src/cog/02_process_pisa_2022_region.py": {
+        "inputs": [f"{RAW_DIR}/Pisa/pisa_2022/CY08MSP_STU_QQQ.sav"],
+        "outputs": [f"{PROC_DIR}/pisa_2022_regional_summary.csv", f"{XLSX_DIR}/pisa_2022_regional_summary.xlsx"],
+    },
+    CONSOLIDATION_SCRIPT: {
+        "inputs": [
+            f"{PROC_DIR}/pisa_2015_states.csv", f"{PROC_DIR}/saeb_2015_states.csv", f"{PROC_DIR}/enem_table_2015.csv",
+            f"{PROC_DIR}/pisa_2018_brazil_states.csv", f"{PROC_DIR}/saeb_2017_states.csv", f"{PROC_DIR}/enem_table_2018.csv",
+            f"{PROC_DIR}/pisa_2022_calculado_oficial.csv", f"{PROC_DIR}/saeb_2023_states.csv", f"{PROC_DIR}/enem_table_2022.csv",
+        ],
+        "outputs": [f"{PROC_DIR}/panel_longitudinal_waves.csv", f"{XLSX_DIR}/tabela_analitica_completa.xlsx"],
+    },
+    "src/cog/05_correlate_pearson_spearman.py": {
+        "inputs": [f"{PROC_DIR}/panel_longitudinal_waves.csv"],
+        "outputs": [
+            "reports/varcog/csv/pearson_correlation.csv", "reports/varcog/csv/pearson_pvalues.csv",
+            "reports/varcog/csv/spearman_correlation.csv", "reports/varcog/csv/spearman_pvalues.csv",
+            f"{IMG_DIR}/correlation_heatmap.png",
+        ],
+    },
+}
+
+# Extractors whose XLSX report is opt-in (forwarded only with --reports)
+REPORT_STAGES = {
+    "src/cog/01_process_saeb_2023_uf_region.py",
+}
+
+# Concurrent stages (each one is a separate child process)
+MAX_WORKERS = min(os.cpu_count() or 1, 4)
+
+# Resident-memory budget (fraction of physical RAM): a runaway stage is terminated
+# instead of thrashing swap. RSS is used rather than RLIMIT_AS because Polars/Arrow
+# thread pools and malloc arenas reserve far more address space than they touch.
+MEMORY_LIMIT_FRACTION = 0.85
+
+# Budget of each stage: the fraction is split across the stages that may run at once,
+# so the concurrent budgets together stay below physical RAM. Computed once in the parent.
+CHILD_MEMORY_LIMIT = int(psutil.virtual_memory().total * MEMORY_LIMIT_FRACTION / MAX_WORKERS)
+
+# Seconds between RSS checks against the budget / between RSS reports of a running stage
+MEMORY_CHECK_INTERVAL = 1
+MEMORY_WATCH_INTERVAL = 10
+
+LOGGER = logging.getLogger("pipeline")
+
+# Tags that map to a non-INFO logging level
+TAG_LEVELS = {
+    "WARNING": logging.WARNING,
+    "ERROR": logging.ERROR,
+    "FAILURE": logging.ERROR,
+    "CRITICAL": logging.CRITICAL,
+}
+
+class PipelineFormatter(logging.Formatter):
+    """Orchestrator events get '[timestamp] [TAG]'; forwarded child lines are written as-is."""
+    def format(self, record):
+        tag = getattr(record, "tag", None)
+        if tag is None:
+            return record.getMessage()
+        return f"[{self.formatTime(record, '%Y-%m-%d %H:%M:%S')}] [{tag}] {record.getMessage()}"
+
+def setup_logging():
+    """
+    Creates a timestamped log file and routes every record through a QueueHandler.
+    A background QueueListener does the console/file I/O, so stage threads never block on it
+    and the FileHandler buffers writes instead of flushing line by line.
+    """
     timestamp = datetime.datetime.now().strftime("%Y%m%d_%H%M%S")
     log_path = LOG_DIR / f"pipeline_execution_{timestamp}.log"
-    return open(log_path, 'w', encoding='utf-8'), log_path
-
-def log(file_handle, message, level="INFO"):
-    """Writes to both console and log file."""
-    timestamp = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-    formatted = f"[{timestamp}] [{level}] {message}"
-    print(formatted)
-    if file_handle:
-        file_handle.write(formatted + "\n")
-        file_handle.flush()
-
-def run_script(script_rel_path, log_handle):
+    
+    formatter = PipelineFormatter()
+    file_handler = logging.FileHandler(log_path, encoding='utf-8')
+    console_handler = logging.StreamHandler(sys.__stdout__)
+    for handler in (file_handler, console_handler):
+        handler.setFormatter(formatter)
+    
+    log_queue = queue.SimpleQueue()
+    LOGGER.setLevel(logging.INFO)
+    LOGGER.propagate = False
+    LOGGER.handlers[:] = [QueueHandler(log_queue)]
+    
+    listener = QueueListener(log_queue, file_handler, console_handler)
+    listener.start()
+    return listener, log_path
+
+def log(message, level="INFO"):
+    """Logs an orchestrator event (console and log file) tagged with `level`."""
+    LOGGER.log(TAG_LEVELS.get(level, logging.INFO), message, extra={"tag": level})
+
+def forward_stream(stream, tag, stats=None):
+    """Forwards each line of a child stream to the console and the log file."""
+    for line in stream:
+        if stats is not None and "MemoryError" in line:
+            stats["memory_error"] = True
+        LOGGER.info(f"[{tag}] {line.rstrip(chr(10))}")
+    stream.close()
+
+class LogTee:
+    """File-like object that forwards complete lines to the console and the log file."""
+    def __init__(self, tag):
+        self.tag = tag
+        self.buffer = ""
+
+    def write(self, text):
+        self.buffer += text
+        *lines, self.buffer = self.buffer.split("\n")
+        for line in lines:
+            LOGGER.info(f"[{self.tag}] {line}")
+        return len(text)
+
+    def flush(self):
+        if self.buffer:
+            self.write("\n")
+
+def is_up_to_date(script_rel_path):
+    """True if every declared output exists and is newer than every declared input."""
+    artifacts = STAGE_ARTIFACTS.get(script_rel_path)
+    if not artifacts:
+        return False
+
+    inputs = [PROJECT_ROOT / p for p in artifacts["inputs"]] + [PROJECT_ROOT / script_rel_path]
+    outputs = [PROJECT_ROOT / p for p in artifacts["outputs"]]
+    
+    if not all(p.exists() for p in outputs):
+        return False
+    
+    newest_input = max((p.stat().st_mtime for p in inputs if p.exists()), default=0)
+    oldest_output = min(p.stat().st_mtime for p in outputs)
+    return oldest_output > newest_input
+
+def tree_rss(ps):
+    """RSS of a stage plus its worker processes (pools spawned by the stage count against its budget)."""
+    rss = ps.memory_info().rss
+    for child in ps.children(recursive=True):
+        try:
+            rss += child.memory_info().rss
+        except psutil.Error:
+            pass  # Worker exited between listing and sampling
+    return rss
+
+def kill_tree(ps):
+    """Kills a stage and every worker it spawned."""
+    for p in ps.children(recursive=True) + [ps]:
+        try:
+            p.kill()
+        except psutil.Error:
+            pass
+
+def watch_memory(proc, tag, stats):
+    """
+    Checks the stage's RSS every MEMORY_CHECK_INTERVAL seconds against CHILD_MEMORY_LIMIT,
+    killing it when over budget; logs it every MEMORY_WATCH_INTERVAL seconds and records the peak.
+    """
+    try:
+        ps = psutil.Process(proc.pid)
+        last_report = 0.0
+        while proc.poll() is None:
+            rss = tree_rss(ps)
+            stats["peak_rss"] = max(stats["peak_rss"], rss)
+            if rss > CHILD_MEMORY_LIMIT:
+                stats["over_budget"] = True
+                log(f"{tag}: RSS {rss / 2**20:,.0f} MB over budget "
+                    f"({CHILD_MEMORY_LIMIT / 2**20:,.0f} MB). Terminating stage.", "MEM")
+                kill_tree(ps)
+                break
+            now = time.monotonic()
+            if now - last_report >= MEMORY_WATCH_INTERVAL:
+                log(f"{tag}: RSS {rss / 2**20:,.0f} MB (peak {stats['peak_rss'] / 2**20:,.0f} MB)", "MEM")
+                last_report = now
+            try:
+                proc.wait(timeout=MEMORY_CHECK_INTERVAL)
+            except subprocess.TimeoutExpired:
+                pass
+    except psutil.Error:
+        pass  # Child already exited
+
+def stage_args(script_rel_path, reports=False):
+    """Command-line arguments forwarded to a stage."""
+    return ["--reports"] if reports and script_rel_path in REPORT_STAGES else []
+
+def run_script(script_rel_path, force=False, reports=False):
     """Executes a single python script via subprocess with logging."""
     full_path = PROJECT_ROOT / script_rel_path
     
     if not full_path.exists():
-        log(log_handle, f"Script not found: {script_rel_path}", "ERROR")
+        log(f"Script not found: {script_rel_path}", "ERROR")
         return False
 
-    log(log_handle, "="*60, "SEP")
-    log(log_handle, f"Running: {script_rel_path}", "START")
+    if not force and is_up_to_date(script_rel_path):
+        log(f"Outputs up to date: {script_rel_path}", "SKIP")
+        return True
+
+    log("="*60, "SEP")
+    log(f"Running: {script_rel_path}", "START")
     
     start_time = time.time()
     
     try:
-        # Capture output to log it to file as well
-        result = subprocess.run(
-            [sys.executable, str(full_path)],
-            capture_output=True,
+        # Stream output line by line (bounded memory, live progress)
+        env = dict(os.environ, PYTHONUNBUFFERED="1")
+        proc = subprocess.Popen(
+            [sys.executable, str(full_path), *stage_args(script_rel_path, reports)],
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE,
+            bufsize=1,
             text=True,
             encoding='utf-8',
-            cwd=PROJECT_ROOT
+            cwd=PROJECT_ROOT,
+            env=env
         )
         
-        # Stream stdout to log and console
-        if result.stdout:
-            print(result.stdout.strip())
-            log_handle.write(result.stdout + "\n")
-        
-        # Stream stderr to log and console
-        if result.stderr:
-            print(f"[STDERR] {result.stderr.strip()}", file=sys.stderr)
-            log_handle.write(f"[STDERR]\n{result.stderr}\n")
+        tag = Path(script_rel_path).stem
+        mem_stats = {"peak_rss": 0, "memory_error": False, "over_budget": False}
+        pumps = [
+            threading.Thread(target=forward_stream, args=(proc.stdout, tag), daemon=True),
+            threading.Thread(target=forward_stream, args=(proc.stderr, f"{tag}][STDERR", mem_stats), daemon=True),
+            threading.Thread(target=watch_memory, args=(proc, tag, mem_stats), daemon=True),
+        ]
+        for t in pumps: t.start()
+        proc.wait()
+        for t in pumps: t.join()
 
-        if result.returncode == 0:
+        if proc.returncode == 0:
             elapsed = time.time() - start_time
-            log(log_handle, f"Finished: {script_rel_path} ({elapsed:.2f}s)", "SUCCESS")
+            log(f"Finished: {script_rel_path} ({elapsed:.2f}s)", "SUCCESS")
             return True
         else:
-            log(log_handle, f"Script crashed: {script_rel_path} (Exit Code: {result.returncode})", "FAILURE")
+            log(f"Script crashed: {script_rel_path} (Exit Code: {proc.returncode})", "FAILURE")
+            if mem_stats["over_budget"] or mem_stats["memory_error"] or proc.returncode == -getattr(signal, "SIGKILL", 9):
+                log(f"{tag} ran out of memory (peak RSS {mem_stats['peak_rss'] / 2**20:,.0f} MB, "
+                    f"limit {CHILD_MEMORY_LIMIT / 2**20:,.0f} MB per stage). Lower the chunk size.", "FAILURE")
             return False
 
     except Exception as e:
-        log(log_handle, f"Execution error: {str(e)}", "CRITICAL")
+        log(f"Execution error: {str(e)}", "CRITICAL")
         return False
 
+def run_script_in_process(script_rel_path, force=False, reports=False):
+    """Executes a single python script inside this interpreter via runpy with logging."""
+    full_path = PROJECT_ROOT / script_rel_path
+    
+    if not full_path.exists():
+        log(f"Script not found: {script_rel_path}", "ERROR")
+        return False
+
+    if not force and is_up_to_date(script_rel_path):
+        log(f"Outputs up to date: {script_rel_path}", "SKIP")
+        return True
+
+    log("="*60, "SEP")
+    log(f"Running (in-process): {script_rel_path}", "START")
+    
+    start_time = time.time()
+    tag = Path(script_rel_path).stem
+    out = LogTee(tag)
+    err = LogTee(f"{tag}][STDERR")
+    exit_code = 0
+    
+    try:
+        with contextlib.chdir(PROJECT_ROOT), contextlib.redirect_stdout(out), contextlib.redirect_stderr(err):
+            saved_argv = sys.argv
+            sys.argv = [str(full_path), *stage_args(script_rel_path, reports)]
+            try:
+                runpy.run_path(str(full_path), run_name="__main__")
+            except SystemExit as e:
+                exit_code = e.code if isinstance(e.code, int) else (0 if e.code is None else 1)
+            finally:
+                sys.argv = saved_argv
+                out.flush()
+                err.flush()
+    except Exception:
+        log(f"Execution error in {script_rel_path}:\n{traceback.format_exc()}", "CRITICAL")
+        return False
+
+    if exit_code == 0:
+        elapsed = time.time() - start_time
+        log(f"Finished: {script_rel_path} ({elapsed:.2f}s)", "SUCCESS")
+        return True
+    log(f"Script crashed: {script_rel_path} (Exit Code: {exit_code})", "FAILURE")
+    return False
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Cognitive Capital Data Pipeline")
+    parser.add_argument("--force", action="store_true", help="Rerun every stage, ignoring up-to-date outputs.")
+    parser.add_argument("--in-process", action="store_true",
+                        help="Run stages sequentially in this interpreter instead of parallel subprocesses.")
+    parser.add_argument("--reports", action="store_true",
+                        help="Ask extractors to also write their XLSX reports.")
+    return parser.parse_args()
+
 def main():
-    log_file, log_path = get_log_file_handle()
+    args = parse_args()
+    listener, log_path = setup_logging()
     
     try:
-        log(log_file, "Starting Cognitive Capital Data Pipeline...", "INIT")
-        log(log_file, f"Project Root: {PROJECT_ROOT}")
-        log(log_file, f"Log File: {log_path}")
+        log("Starting Cognitive Capital Data Pipeline...", "INIT")
+        log(f"Project Root: {PROJECT_ROOT}")
+        log(f"Log File: {log_path}")
+        # In-process stages share cwd/stdout, so they must run one at a time
+        runner = run_script_in_process if args.in_process else run_script
+        workers = 1 if args.in_process else MAX_WORKERS
+        log(f"Max Parallel Stages: {workers}")
+        if args.force:
+            log("Force mode: up-to-date check disabled.")
         
         total_start = time.time()
         success_count = 0
         
-        for script in PIPELINE_SCRIPTS:
-            success = run_script(script, log_file)
-            
-            if success:
-                success_count += 1
-            else:
-                log(log_file, f"Pipeline step failed: {script}", "WARNING")
+        done = set()
+        pending = dict(PIPELINE_DAG)
+        running = {}
+        aborted = False
+        
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            while pending or running:
+                # Submit every script whose dependencies have all finished
+                if not aborted:
+                    ready = [s for s, deps in pending.items() if all(d in done for d in deps)]
+                    for script in ready:
+                        del pending[script]
+                        running[executor.submit(runner, script, args.force, args.reports)] = script
                 
-                # CRITICAL CHECK:
-                # If consolidation fails, downstream analytics are impossible.
-                if "03_consolidate" in script:
-                    log(log_file, "Consolidation failed. Stopping downstream analytics.", "CRITICAL")
+                if not running:
                     break
+                
+                finished, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in finished:
+                    script = running.pop(future)
+                    done.add(script)
+                    
+                    if future.result():
+                        success_count += 1
+                    else:
+                        log(f"Pipeline step failed: {script}", "WARNING")
+                        
+                        # CRITICAL CHECK:
+                        # If consolidation fails, downstream analytics are impossible.
+                        if "03_consolidate" in script:
+                            log("Consolidation failed. Stopping downstream analytics.", "CRITICAL")
+                            aborted = True
 
         total_elapsed = time.time() - total_start
-        log(log_file, "="*60, "SEP")
-        log(log_file, "PIPELINE EXECUTION SUMMARY", "SUMMARY")
-        log(log_file, f"Total Scripts Queued: {len(PIPELINE_SCRIPTS)}")
-        log(log_file, f"Successful:          {success_count}")
-        log(log_file, f"Failed/Skipped:      {len(PIPELINE_SCRIPTS) - success_count}")
-        log(log_file, f"Total Time:          {total_elapsed / 60:.2f} minutes")
+        log("="*60, "SEP")
+        log("PIPELINE EXECUTION SUMMARY", "SUMMARY")
+        log(f"Total Scripts Queued: {len(PIPELINE_SCRIPTS)}")
+        log(f"Successful:          {success_count}")
+        log(f"Failed/Skipped:      {len(PIPELINE_SCRIPTS) - success_count}")
+        log(f"Total Time:          {total_elapsed / 60:.2f} minutes")
         
     finally:
-        log_file.close()
+        listener.stop()
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
@@ -28,6 +28,8 @@ import os
 import sys
 import time
 import pyreadstat
+import pyarrow as pa
+import pyarrow.compute as pc
 from pathlib import Path
 from datetime import timedelta
 
@@ -63,6 +65,22 @@ class ExecutionTimer:
         self.interval = time.perf_counter() - self.start
         print(f"[TIMER] Execution time: {str(timedelta(seconds=self.interval))}")
 
+def read_brazil_rows(sav_path, cols, brazil_values, apply_value_formats=False):
+    """Streams the SAV in chunks and keeps only Brazil rows; the international file is never fully loaded."""
+    reader = pyreadstat.read_file_in_chunks(
+        pyreadstat.read_sav, str(sav_path), chunksize=50_000, usecols=cols,
+        apply_value_formats=apply_value_formats, formats_as_category=apply_value_formats
+    )
+    keep = []
+    for chunk, _ in reader:
+        # Low-cardinality CNT: match the category labels once, broadcast through the integer codes
+        cnt = chunk['CNT'].astype('category')
+        is_bra = np.append(cnt.cat.categories.isin(brazil_values), False)
+        chunk = chunk[is_bra[cnt.cat.codes.to_numpy()]]
+        if not chunk.empty: keep.append(chunk)
+    # Concat of pre-filtered chunks is already a fresh frame: no defensive copy needed
+    return pd.concat(keep, ignore_index=True) if keep else pd.DataFrame(columns=cols)
+
 # --- 3. CORE ETL CLASS ---
 
 class PisaUnifiedETL:
@@ -102,13 +120,10 @@ class PisaUnifiedETL:
         IBGE_TO_REGION = {code: reg for reg, codes in REGIONAL_MAP.items() for code in codes}
         IBGE_TO_SIGLA = {11:'RO', 12:'AC', 13:'AM', 14:'RR', 15:'PA', 16:'AP', 17:'TO', 21:'MA', 22:'PI', 23:'CE', 24:'RN', 25:'PB', 26:'PE', 27:'AL', 28:'SE', 29:'BA', 31:'MG', 32:'ES', 33:'RJ', 35:'SP', 41:'PR', 42:'SC', 43:'RS', 50:'MS', 51:'MT', 52:'GO', 53:'DF'}
 
-        def resolve_ibge_from_text(text_label):
-            if not isinstance(text_label, str): return None
-            text_upper = text_label.upper()
-            sorted_names = sorted(NAME_TO_IBGE.keys(), key=len, reverse=True)
-            for name in sorted_names:
-                if name in text_upper: return NAME_TO_IBGE[name]
-            return None
+        def ibge_code_for(label):
+            # Longest state name found anywhere in the label wins ('MATO GROSSO DO SUL' over 'MATO GROSSO')
+            hits = [n for n in NAME_TO_IBGE if n in label]
+            return NAME_TO_IBGE[max(hits, key=len)] if hits else np.nan
 
         try:
             _, meta = pyreadstat.read_sav(str(target_file), metadataonly=True)
@@ -116,30 +131,39 @@ class PisaUnifiedETL:
             region_col = next((c for c in candidates if c in meta.column_names), None)
             scores = [c for c in meta.column_names if c.startswith('PV1') and any(x in c for x in ['MATH', 'READ', 'SCIE'])]
             
-            use_cols = list(set([region_col] + scores))
+            use_cols = [region_col] + scores
             if 'CNT' in meta.column_names: use_cols.append('CNT')
+            use_cols = list(dict.fromkeys(use_cols))
 
             print(f"[INFO] Loading {len(use_cols)} columns...")
-            df, meta = pyreadstat.read_sav(str(target_file), usecols=use_cols)
+            # Row ranges decoded in parallel processes (SAV decode is CPU-bound)
+            df, _ = pyreadstat.read_file_multiprocessing(
+                pyreadstat.read_sav, str(target_file), num_processes=os.cpu_count(), usecols=use_cols,
+                disable_datetime_conversion=True
+            )
             
+            # Boolean row selection already yields a new frame; no defensive copy needed
             if 'CNT' in df.columns:
-                df = df[df['CNT'] == 'BRA'].copy()
+                df = df.loc[(df['CNT'] == 'BRA').to_numpy()]
 
+            stratum = df[region_col].astype(str)
             if region_col in meta.variable_value_labels:
                 labels = meta.variable_value_labels[region_col]
-                df['STRATUM_TEXT'] = df[region_col].map(labels).fillna(df[region_col].astype(str))
-            else:
-                df['STRATUM_TEXT'] = df[region_col].astype(str)
+                stratum = df[region_col].map(labels).fillna(stratum)
+            df = df.assign(STRATUM_TEXT=stratum)
 
-            df['IBGE_CODE'] = df['STRATUM_TEXT'].apply(resolve_ibge_from_text)
+            # Resolved once per distinct stratum label, broadcast by category code (trailing NaN = missing label)
+            strat = df['STRATUM_TEXT'].astype('category')
+            code_lut = np.array([ibge_code_for(c) for c in strat.cat.categories.astype(str).str.upper()] + [np.nan])
+            df['IBGE_CODE'] = pd.Series(code_lut[strat.cat.codes.to_numpy()], index=df.index).astype('Int16')
             print(f"[STATS] Mapped Rows: {df['IBGE_CODE'].notnull().sum()}/{len(df)}")
             
-            df = df.dropna(subset=['IBGE_CODE'])
-            if 'PV1MATH' in df.columns: df['Math'] = df['PV1MATH']
-            if 'PV1READ' in df.columns: df['Read'] = df['PV1READ']
-            if 'PV1SCIE' in df.columns: df['Science'] = df['PV1SCIE']
-
-            summary = df.groupby('IBGE_CODE')[['Math', 'Read', 'Science']].mean().reset_index()
+            # Group-by mean on Arrow's C++ hash kernels; scores are renamed, not copied
+            table = pa.Table.from_pandas(df[['IBGE_CODE', 'PV1MATH', 'PV1READ', 'PV1SCIE']], preserve_index=False)
+            table = table.rename_columns(['IBGE_CODE', 'Math', 'Read', 'Science'])
+            table = table.filter(pc.is_valid(table['IBGE_CODE']))
+            agg = table.group_by('IBGE_CODE').aggregate([('Math', 'mean'), ('Read', 'mean'), ('Science', 'mean')])
+            summary = agg.to_pandas().rename(columns={'Math_mean': 'Math', 'Read_mean': 'Read', 'Science_mean': 'Science'})
             summary['UF'] = summary['IBGE_CODE'].map(IBGE_TO_SIGLA)
             summary['Region'] = summary['IBGE_CODE'].map(IBGE_TO_REGION)
             summary['Cognitive_Global_Mean'] = summary[['Math', 'Read', 'Science']].mean(axis=1)
@@ -155,7 +179,8 @@ class PisaUnifiedETL:
             out_csv = CSV_OUT_DIR / 'pisa_2015_states.csv'
             out_xlsx = XLSX_OUT_DIR / 'pisa_2015_states.xlsx'
             summary.to_csv(out_csv, index=False)
-            summary.to_excel(out_xlsx, index=False)
+            with pd.ExcelWriter(out_xlsx, engine='xlsxwriter') as writer:
+                summary.to_excel(writer, index=False)
             print(f"[SUCCESS] Saved: {out_csv.name}")
 
         except Exception as e:
@@ -178,31 +203,23 @@ class PisaUnifiedETL:
         cols = ['CNT', 'STRATUM', 'PV1MATH', 'PV1READ', 'PV1SCIE']
         
         try:
-            # FIX: convert_categoricals=False forces pandas to read 'BRA0206' instead of the label
-            df = pd.read_spss(str(RAW_FILE), usecols=cols, convert_categoricals=False)
-            
-            # Filter Brazil (Handles 'BRA' string or 76 numeric)
-            df = df[df['CNT'].astype(str).str.contains('BRA|Brazil|76', case=False, na=False)].copy()
+            # FIX: raw codes (no value labels) keep 'BRA0206' instead of the label
+            # Filter Brazil while reading (Handles 'BRA' string or 76 numeric)
+            df = read_brazil_rows(RAW_FILE, cols, ['BRA', 'Brazil', 76])
             print(f"      - Brazil rows found: {len(df)}")
             
             if len(df) == 0: print("[ERROR] No Brazil rows found."); return
 
             # --- 2018 LOGIC: STRATUM DIGITS ---
-            def get_region_code_2018(stratum):
-                s = str(stratum).upper().strip()
-                if s.startswith('BRA'):
-                    # PISA 2018: BRA + Region(2) + Stratum(2)
-                    # Extract positions 3 and 4 (0-based) -> BRA(012) XX(34)
-                    code = s[3:5] 
-                    if code == '01': return 'North'
-                    if code == '02': return 'Northeast'
-                    if code == '03': return 'Southeast'
-                    if code == '04': return 'South'
-                    if code == '05': return 'Center-West'
-                return 'UNKNOWN'
-
+            # PISA 2018: BRA + Region(2) + Stratum(2) -> positions 3 and 4 (0-based) hold the region code.
+            # Decoded once per distinct stratum label, then broadcast to the students by category code
+            # (the extra trailing 'UNKNOWN' slot catches code -1, i.e. missing STRATUM).
+            REGION_CODES_2018 = {'01': 'North', '02': 'Northeast', '03': 'Southeast', '04': 'South', '05': 'Center-West'}
             print("[INFO] Decoding Regions from numeric Stratum...")
-            df['Region'] = df['STRATUM'].apply(get_region_code_2018)
+            strat = df['STRATUM'].astype('category')
+            cats = strat.cat.categories.astype(str).str.upper().str.strip()
+            region_lut = np.where(cats.str.startswith('BRA'), cats.str[3:5].map(REGION_CODES_2018).fillna('UNKNOWN'), 'UNKNOWN')
+            df['Region'] = np.append(region_lut, 'UNKNOWN')[strat.cat.codes.to_numpy()]
             
             # Validation
             unknowns = len(df[df['Region'] == 'UNKNOWN'])
@@ -229,7 +246,8 @@ class PisaUnifiedETL:
             csv_path = CSV_OUT_DIR / 'pisa_2018_regional_summary.csv'
             xlsx_path = XLSX_OUT_DIR / 'pisa_2018_regional_summary.xlsx'
             df_final.to_csv(csv_path, index=False)
-            df_final.to_excel(xlsx_path, index=False)
+            with pd.ExcelWriter(xlsx_path, engine='xlsxwriter') as writer:
+                df_final.to_excel(writer, index=False)
             print(f"[SUCCESS] Saved: {csv_path.name}")
 
         except Exception as e:
@@ -252,25 +270,25 @@ class PisaUnifiedETL:
         cols = ['CNT', 'STRATUM', 'PV1MATH', 'PV1READ', 'PV1SCIE']
         
         try:
-            # 2022 is usually safer with default categoricals due to text matching
-            df = pd.read_spss(str(RAW_FILE), usecols=cols)
-            df = df[df['CNT'].astype(str).str.contains('Brazil|BRA', case=False, na=False)].copy()
+            # 2022 is usually safer with value labels applied due to text matching
+            df = read_brazil_rows(RAW_FILE, cols, ['BRA', 'Brazil'], apply_value_formats=True)
             print(f"      - Brazil rows found: {len(df)}")
             
             if len(df) == 0: print("[ERROR] No Brazil rows found."); return
 
             # --- 2022 LOGIC: TEXT MATCHING ---
-            def get_region_2022(stratum):
-                s = str(stratum).upper()
-                if 'CENTRO-OESTE' in s or 'CENTRO OESTE' in s: return 'Center-West'
-                if 'NORDESTE' in s: return 'Northeast'
-                if 'SUDESTE' in s: return 'Southeast'
-                if 'NORTE' in s: return 'North'
-                if 'SUL' in s: return 'South'
-                return 'UNKNOWN'
-
+            # Keyword tests run once per distinct stratum label (vectorized .str.contains), in priority order:
+            # CENTRO-OESTE / NORDESTE / SUDESTE before the bare NORTE / SUL substrings
             print("[INFO] Aggregating by Macro-Region (Text Match)...")
-            df['Region'] = df['STRATUM'].apply(get_region_2022)
+            strat = df['STRATUM'].astype('category')
+            cats = strat.cat.categories.astype(str).str.upper()
+            region_lut = np.select(
+                [cats.str.contains('CENTRO-OESTE|CENTRO OESTE'), cats.str.contains('NORDESTE', regex=False),
+                 cats.str.contains('SUDESTE', regex=False), cats.str.contains('NORTE', regex=False),
+                 cats.str.contains('SUL', regex=False)],
+                ['Center-West', 'Northeast', 'Southeast', 'North', 'South'], default='UNKNOWN'
+            )
+            df['Region'] = np.append(region_lut, 'UNKNOWN')[strat.cat.codes.to_numpy()]
             df = df[df['Region'] != 'UNKNOWN']
             
             means = df.groupby('Region')[['PV1MATH', 'PV1READ', 'PV1SCIE']].mean().reset_index()
@@ -286,7 +304,8 @@ class PisaUnifiedETL:
             csv_path = CSV_OUT_DIR / 'pisa_2022_regional_summary.csv'
             xlsx_path = XLSX_OUT_DIR / 'pisa_2022_regional_summary.xlsx'
             df_final.to_csv(csv_path, index=False)
-            df_final.to_excel(xlsx_path, index=False)
+            with pd.ExcelWriter(xlsx_path, engine='xlsxwriter') as writer:
+                df_final.to_excel(writer, index=False)
             print(f"[SUCCESS] Saved: {csv_path.name}")
 
         except Exception as e:
@@ -20,6 +20,8 @@ DESCRIPTION:
 """
 import pandas as pd
 import numpy as np
+import matplotlib
+matplotlib.use('Agg')  # Headless backend: no GUI probing in batch runs
 import seaborn as sns
 import matplotlib.pyplot as plt
 from scipy.stats import zscore
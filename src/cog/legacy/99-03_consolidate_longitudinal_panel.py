@@ -4,6 +4,9 @@ SCRIPT:      src/cog/03_consolidate_longitudinal_panel.py
 DESCRIPTION: Merges PROCESSED PISA, SAEB, and ENEM files into the Master Panel.
 """
 import pandas as pd
+import pyarrow as pa
+import pyarrow.csv as pacsv
+import pyarrow.parquet as pq
 from pathlib import Path
 
 # --- CONFIGURATION ---
@@ -32,22 +35,39 @@ WAVES = {
 }
 
 def load_processed(path, type_):
-    if not path.exists(): return None
-    
-    # Tratamento para CSVs com separadores diferentes
-    try:
-        df = pd.read_csv(path, sep=';') if 'enem' in str(path) else pd.read_csv(path)
-        # Fallback se a leitura falhar (ex: era virgula mas tentou ponto e virgula)
-        if df.shape[1] < 2: 
-            df = pd.read_csv(path, sep=',' if 'enem' in str(path) else ';')
-    except:
-        return None
+    # Prioriza o espelho Parquet (tipado, sem re-parse do CSV) quando existir e não for mais antigo que o CSV:
+    # nem todo produtor grava o Parquet, então um CSV regravado depois prevalece
+    parquet_path = path.with_suffix('.parquet')
+    table = None
+    if parquet_path.exists() and (not path.exists() or parquet_path.stat().st_mtime >= path.stat().st_mtime):
+        try:
+            table = pq.read_table(parquet_path)
+        except:
+            table = None
+
+    if table is None:
+        if not path.exists(): return None
+        
+        # Separador decidido pelo schema do primeiro bloco (Arrow); o arquivo é lido uma única vez
+        try:
+            for sep in ([';', ','] if 'enem' in str(path) else [',', ';']):
+                try:
+                    names = pacsv.open_csv(
+                        path,
+                        read_options=pacsv.ReadOptions(block_size=1 << 16, use_threads=False),
+                        parse_options=pacsv.ParseOptions(delimiter=sep)
+                    ).schema.names
+                except pa.ArrowInvalid:
+                    continue
+                if len(names) >= 2: break
+            table = pacsv.read_csv(path, parse_options=pacsv.ParseOptions(delimiter=sep))
+        except:
+            return None
 
-    # Padronização de Colunas
-    df.columns = [c.upper() for c in df.columns] # Normalizar caixa alta
+    # Padronização de Colunas (caixa alta só nos nomes do schema)
+    cols = {c.upper(): c for c in table.column_names}
     
     # Renomear para UF e SCORE
-    cols = df.columns
     uf_col = next((c for c in cols if 'UF' in c), None)
     
     # Identificar coluna de nota
@@ -60,7 +80,13 @@ def load_processed(path, type_):
         score_col = next((c for c in cols if 'GENERAL' in c or 'MEAN' in c), None)
 
     if uf_col and score_col:
-        return df[[uf_col, score_col]].rename(columns={uf_col: 'UF', score_col: f'{type_.upper()}_SCORE'})
+        sub = table.select([cols[uf_col], cols[score_col]])
+        # Nota sempre float64: uma onda cujo CSV veio só com inteiros não quebra a concatenação das ondas
+        if pa.types.is_integer(sub.schema.field(1).type):
+            sub = sub.set_column(1, sub.schema.field(1).name, sub.column(1).cast(pa.float64()))
+        df = sub.to_pandas(types_mapper=pd.ArrowDtype)
+        df.columns = ['UF', f'{type_.upper()}_SCORE']
+        return df
     
     return None
 
@@ -77,24 +103,27 @@ if __name__ == "__main__":
         enem = load_processed(files['enem'], 'enem')
         
         # Merge
-        parts = [d for d in [pisa, saeb, enem] if d is not None]
+        # Alinhamento único pelo índice UF (uma concatenação em vez de merges encadeados)
+        parts = [d.set_index('UF') for d in [pisa, saeb, enem] if d is not None]
         if parts:
-            wave_df = parts[0]
-            for p in parts[1:]:
-                wave_df = pd.merge(wave_df, p, on='UF', how='outer')
+            wave_df = pd.concat(parts, axis=1, join='outer').rename_axis('UF').reset_index()
             
             wave_df['WAVE'] = year
             frames.append(wave_df)
 
     if frames:
-        master = pd.concat(frames, ignore_index=True)
+        # Concatenação colunar no Arrow (ondas sem alguma fonte recebem nulos via promoção de schema)
+        table = pa.concat_tables([pa.Table.from_pandas(f, preserve_index=False) for f in frames], promote_options='permissive')
         # Reordenar
-        cols = ['WAVE', 'UF'] + [c for c in master.columns if c not in ['WAVE', 'UF']]
-        master = master[cols]
+        cols = ['WAVE', 'UF'] + [c for c in table.column_names if c not in ['WAVE', 'UF']]
+        table = table.select(cols)
 
-        # Salvar
+        # Salvar (Parquet direto da tabela Arrow, sem passar pelo pandas)
+        pq.write_table(table, PROC_DIR / 'panel_longitudinal_waves.parquet', compression='zstd')
+        master = table.to_pandas()
         master.to_csv(PROC_DIR / 'panel_longitudinal_waves.csv', index=False)
-        master.to_excel(REPORT_XLSX_DIR / 'tabela_analitica_completa.xlsx', index=False)
+        with pd.ExcelWriter(REPORT_XLSX_DIR / 'tabela_analitica_completa.xlsx', engine='xlsxwriter') as writer:
+            master.to_excel(writer, index=False)
         print(f"[SUCCESS] Master Panel Created with {len(master)} rows.")
     else:
         print("[FAIL] No processed files found. Run extractors (01, 02, 04) first.")
\ No newline at end of file
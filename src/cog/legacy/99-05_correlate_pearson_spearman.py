@@ -4,11 +4,15 @@ SCRIPT:      src/cog/05_correlate_pearson_spearman.py
 DESCRIPTION: Calculates correlation matrices from the Master Longitudinal Panel.
 """
 import pandas as pd
+import matplotlib
+matplotlib.use('Agg')  # Headless backend: no GUI probing in batch runs
 import seaborn as sns
 import matplotlib.pyplot as plt
 import os
 import numpy as np
-from scipy.stats import pearsonr, spearmanr
+import pyarrow as pa
+import pyarrow.csv as pacsv
+from scipy.stats import rankdata, t as t_dist
 
 # Caminhos
 BASE_PATH = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -17,29 +21,41 @@ DATA_PROCESSED = os.path.join(BASE_PATH, 'data', 'processed')
 os.makedirs(os.path.join(REPORT_DIR, 'csv'), exist_ok=True)
 os.makedirs(os.path.join(REPORT_DIR, 'graficos'), exist_ok=True)
 
-def calculate_pvalues(df, method='pearson'):
-    df = df.dropna()
-    dfcols = pd.DataFrame(columns=df.columns)
-    pvalues = dfcols.transpose().join(dfcols, how='outer')
-    for r in df.columns:
-        for c in df.columns:
-            if method == 'pearson':
-                pvalues[r][c] = round(pearsonr(df[r], df[c])[1], 4)
-            else:
-                pvalues[r][c] = round(spearmanr(df[r], df[c])[1], 4)
-    return pvalues
+def write_matrix_csv(matrix, path):
+    # Escritor CSV do Arrow (C++); a 1a coluna mantém os rótulos das variáveis com cabeçalho vazio, como no to_csv.
+    # Sem aspas (rótulos e números não contêm vírgula; o Arrow aborta se algum contiver)
+    pacsv.write_csv(pa.Table.from_pandas(matrix.rename_axis('').reset_index(), preserve_index=False), path,
+                    write_options=pacsv.WriteOptions(quoting_style='none'))
+
+def corr_matrix(X):
+    # Pearson como um único produto de matrizes sobre as colunas padronizadas (Z'Z / (n-1))
+    Z = (X - X.mean(axis=0)) / X.std(axis=0, ddof=1)
+    return np.clip((Z.T @ Z) / (len(X) - 1), -1.0, 1.0)
+
+def calculate_pvalues(r, n):
+    # Forma fechada sobre a matriz inteira: t = r*sqrt((n-2)/(1-r^2)), p = 2*sf(|t|, n-2)
+    # (mesmo p bicaudal de pearsonr/spearmanr; Spearman = Pearson sobre os postos)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        t = r * np.sqrt((n - 2) / (1 - r * r))
+    p = 2 * t_dist.sf(np.abs(t), n - 2)
+    np.fill_diagonal(p, 0.0)
+    return p
 
 def main():
     print("[INFO] Starting Correlation Analysis...")
     
     # Busca inteligente do arquivo consolidado
     target_file = None
+    # Prioridade 0: Espelho Parquet do passo 03 (tipado, sem re-parse)
+    p0 = os.path.join(DATA_PROCESSED, 'panel_longitudinal_waves.parquet')
     # Prioridade 1: Arquivo gerado pelo passo 03
     p1 = os.path.join(DATA_PROCESSED, 'panel_longitudinal_waves.csv')
     # Prioridade 2: Arquivo consolidado regional (fonte alternativa)
     p2 = os.path.join(DATA_PROCESSED, 'Regional_Data_Source.csv')
     
-    if os.path.exists(p1):
+    if os.path.exists(p0):
+        target_file = p0
+    elif os.path.exists(p1):
         target_file = p1
     elif os.path.exists(p2):
         target_file = p2
@@ -49,7 +65,7 @@ def main():
         return
 
     print(f"[INFO] Loading data from: {target_file}")
-    df = pd.read_csv(target_file)
+    df = pd.read_parquet(target_file) if target_file.endswith('.parquet') else pd.read_csv(target_file)
     
     # Identificar colunas numéricas de interesse
     # Remove colunas de metadados como Region, UF, Year se estiverem no índice
@@ -69,19 +85,39 @@ def main():
         print("[ERROR] Not enough variables for correlation.")
         return
 
+    # Casos completos uma única vez; notas e postos (empates pela média) viram matrizes NumPy reaproveitadas
+    # por Pearson e Spearman: duas multiplicações de matrizes no lugar de quatro passadas .corr()/p-valor
+    complete = df_numeric.dropna()
+    n = len(complete)
+    # Com menos de 3 casos completos não há graus de liberdade para os p-valores;
+    # as matrizes r (par a par) continuam sendo gravadas
+    has_p = n >= 3
+    if not has_p:
+        print(f"[WARN] Only {n} complete rows: skipping p-values, writing correlation matrices only.")
+    X = complete.to_numpy(dtype=np.float64)
+    r_pearson = corr_matrix(X) if has_p else None
+    r_spearman = corr_matrix(rankdata(X, axis=0)) if has_p else None
+    as_frame = lambda m: pd.DataFrame(m, index=complete.columns, columns=complete.columns)
+    fast_r = has_p and n == len(df_numeric)
+
     # 1. Pearson Correlation
     print("[ANALYTICS] Calculating Pearson Matrix...")
-    pearson_corr = df_numeric.corr(method='pearson')
-    pearson_p = calculate_pvalues(df_numeric, method='pearson')
+    # Com lacunas, o r mantém a deleção par a par do .corr(); os p-valores seguem em casos completos
+    pearson_corr = as_frame(r_pearson) if fast_r else df_numeric.corr(method='pearson')
     
     # Salvar outputs
-    pearson_corr.to_csv(os.path.join(REPORT_DIR, 'csv', 'pearson_correlation.csv'))
-    pearson_p.to_csv(os.path.join(REPORT_DIR, 'csv', 'pearson_pvalues.csv'))
+    write_matrix_csv(pearson_corr, os.path.join(REPORT_DIR, 'csv', 'pearson_correlation.csv'))
+    if has_p:
+        pearson_p = as_frame(calculate_pvalues(r_pearson, n)).round(4)
+        write_matrix_csv(pearson_p, os.path.join(REPORT_DIR, 'csv', 'pearson_pvalues.csv'))
     
     # 2. Spearman Correlation
     print("[ANALYTICS] Calculating Spearman Matrix...")
-    spearman_corr = df_numeric.corr(method='spearman')
-    spearman_corr.to_csv(os.path.join(REPORT_DIR, 'csv', 'spearman_correlation.csv'))
+    spearman_corr = as_frame(r_spearman) if fast_r else df_numeric.corr(method='spearman')
+    write_matrix_csv(spearman_corr, os.path.join(REPORT_DIR, 'csv', 'spearman_correlation.csv'))
+    if has_p:
+        spearman_p = as_frame(calculate_pvalues(r_spearman, n)).round(4)
+        write_matrix_csv(spearman_p, os.path.join(REPORT_DIR, 'csv', 'spearman_pvalues.csv'))
     
     # 3. Visualização Rápida
     plt.figure(figsize=(12, 10))
@@ -89,6 +125,7 @@ def main():
     plt.title('Cognitive Capital Correlation Matrix (Pearson)')
     plt.tight_layout()
     plt.savefig(os.path.join(REPORT_DIR, 'graficos', 'correlation_heatmap.png'))
+    plt.close()
     print("[SUCCESS] Analysis complete. Reports saved in reports/varcog/")
 
 if __name__ == "__main__":
@@ -17,13 +17,16 @@ DESCRIPTION:
 
 INPUT:
     - data/raw/Pisa/pisa_2015/*STU*.sav
+    - data/cache/pisa_2015_stu.parquet (decoded Brazil rows, reused while newer than the SAV)
 
 OUTPUT:
     - data/processed/pisa_2015_states.csv
+    - data/processed/pisa_2015_states.parquet (zstd mirror for downstream steps)
     - reports/varcog/xlsx/pisa_2015_states.xlsx
 """
 
 import pandas as pd
+import polars as pl
 import os
 import sys
 import pyreadstat
@@ -49,9 +52,12 @@ DATA_RAW = os.path.join(BASE_PATH, 'data', 'raw', 'Pisa', 'pisa_2015')
 CSV_DIR = os.path.join(BASE_PATH, 'data', 'processed')
 # Excel reports go to the analytics folder
 XLSX_DIR = os.path.join(BASE_PATH, 'reports', 'varcog', 'xlsx')
+# Decoded student rows (re-runs skip the SPSS decode)
+CACHE_DIR = os.path.join(BASE_PATH, 'data', 'cache')
 
 os.makedirs(CSV_DIR, exist_ok=True)
 os.makedirs(XLSX_DIR, exist_ok=True)
+os.makedirs(CACHE_DIR, exist_ok=True)
 
 # --- 3. MAPPING DICTIONARIES ---
 NAME_TO_IBGE = {
@@ -82,13 +88,63 @@ IBGE_TO_SIGLA = {
     50:'MS', 51:'MT', 52:'GO', 53:'DF'
 }
 
-def resolve_ibge_from_text(text_label):
-    if not isinstance(text_label, str): return None
-    text_upper = text_label.upper()
-    sorted_names = sorted(NAME_TO_IBGE.keys(), key=len, reverse=True)
-    for name in sorted_names:
-        if name in text_upper: return NAME_TO_IBGE[name]
-    return None
+def ibge_code_for(label):
+    """Longest state name found anywhere in the label wins ('MATO GROSSO DO SUL' over 'MATO GROSSO')."""
+    hits = [n for n in NAME_TO_IBGE if n in label]
+    return NAME_TO_IBGE[max(hits, key=len)] if hits else np.nan
+
+def load_students(target_file):
+    """
+    Returns Brazil's student rows as STRATUM_TEXT + PV1 score columns.
+    The first run decodes the SAV (value labels included) and stores the result
+    in data/cache/pisa_2015_stu.parquet; later runs read the cache while it is
+    newer than the SAV and skip the SPSS decode entirely.
+    """
+    cache_path = os.path.join(CACHE_DIR, 'pisa_2015_stu.parquet')
+    if os.path.exists(cache_path) and os.path.getmtime(cache_path) > os.path.getmtime(target_file):
+        print(f"[CACHE] Using Parquet cache: {cache_path}")
+        return pd.read_parquet(cache_path)
+
+    # Metadata Scan
+    _, meta = pyreadstat.read_sav(target_file, metadataonly=True)
+    
+    candidates = ['STRATUM', 'REGION', 'CNT', 'ST004D01T']
+    region_col = next((c for c in candidates if c in meta.column_names), None)
+    scores = [c for c in meta.column_names if c.startswith('PV1') and any(x in c for x in ['MATH', 'READ', 'SCIE'])]
+    
+    if not region_col:
+        print("[CRITICAL] No region column found.")
+        return None
+
+    use_cols = [region_col] + scores
+    if 'CNT' in meta.column_names: use_cols.append('CNT')
+    use_cols = list(dict.fromkeys(use_cols))
+
+    # Data Load
+    print(f"[INFO] Loading {len(use_cols)} columns...")
+    # Row ranges decoded in parallel processes (SAV decode is CPU-bound)
+    df, _ = pyreadstat.read_file_multiprocessing(
+        pyreadstat.read_sav, target_file, num_processes=os.cpu_count(), usecols=use_cols,
+        disable_datetime_conversion=True
+    )
+    
+    # Boolean row selection already yields a new frame; no defensive copy needed
+    if 'CNT' in df.columns:
+        df = df.loc[(df['CNT'] == 'BRA').to_numpy()]
+
+    # Apply Labels
+    stratum = df[region_col].astype(str)
+    if region_col in meta.variable_value_labels:
+        print(f"[INFO] Decoding '{region_col}' labels...")
+        labels = meta.variable_value_labels[region_col]
+        stratum = df[region_col].map(labels).fillna(stratum)
+    df = df.assign(STRATUM_TEXT=stratum)
+
+    df = df[['STRATUM_TEXT'] + scores].reset_index(drop=True)
+    tmp_path = cache_path + '.part'
+    df.to_parquet(tmp_path, engine='pyarrow', compression='zstd', index=False)
+    os.replace(tmp_path, cache_path)
+    return df
 
 def process_pisa_2015():
     print("="*60)
@@ -108,37 +164,14 @@ def process_pisa_2015():
     print(f"[FILE] Reading: {sav_files[0]}")
 
     try:
-        # Metadata Scan
-        _, meta = pyreadstat.read_sav(target_file, metadataonly=True)
-        
-        candidates = ['STRATUM', 'REGION', 'CNT', 'ST004D01T']
-        region_col = next((c for c in candidates if c in meta.column_names), None)
-        scores = [c for c in meta.column_names if c.startswith('PV1') and any(x in c for x in ['MATH', 'READ', 'SCIE'])]
-        
-        if not region_col:
-            print("[CRITICAL] No region column found.")
-            return
-
-        use_cols = list(set([region_col] + scores))
-        if 'CNT' in meta.column_names: use_cols.append('CNT')
-
-        # Data Load
-        print(f"[INFO] Loading {len(use_cols)} columns...")
-        df, meta = pyreadstat.read_sav(target_file, usecols=use_cols)
-        
-        if 'CNT' in df.columns:
-            df = df[df['CNT'] == 'BRA'].copy()
-
-        # Apply Labels
-        if region_col in meta.variable_value_labels:
-            print(f"[INFO] Decoding '{region_col}' labels...")
-            labels = meta.variable_value_labels[region_col]
-            df['STRATUM_TEXT'] = df[region_col].map(labels).fillna(df[region_col].astype(str))
-        else:
-            df['STRATUM_TEXT'] = df[region_col].astype(str)
+        df = load_students(target_file)
+        if df is None: return
 
         # Geocoding
-        df['IBGE_CODE'] = df['STRATUM_TEXT'].apply(resolve_ibge_from_text)
+        # Resolved once per distinct stratum label, broadcast by category code (trailing NaN = missing label)
+        strat = df['STRATUM_TEXT'].astype('category')
+        code_lut = np.array([ibge_code_for(c) for c in strat.cat.categories.astype(str).str.upper()] + [np.nan])
+        df['IBGE_CODE'] = pd.Series(code_lut[strat.cat.codes.to_numpy()], index=df.index).astype('Int16')
         valid_rows = df['IBGE_CODE'].notnull().sum()
         print(f"[STATS] Mapped Rows: {valid_rows}/{len(df)}")
         
@@ -146,23 +179,31 @@ def process_pisa_2015():
             print("[CRITICAL] Mapping failed. Aborting.")
             return
 
-        # Cleaning
-        df = df.dropna(subset=['IBGE_CODE'])
-        cols_math = [c for c in df.columns if 'MATH' in c]
-        cols_read = [c for c in df.columns if 'READ' in c]
-        cols_scie = [c for c in df.columns if 'SCIE' in c]
-        
-        if cols_math: df['Math'] = df[cols_math[0]]
-        if cols_read: df['Read'] = df[cols_read[0]]
-        if cols_scie: df['Science'] = df[cols_scie[0]]
-
-        # Aggregation
-        summary = df.groupby('IBGE_CODE')[['Math', 'Read', 'Science']].mean().reset_index()
-        summary['UF'] = summary['IBGE_CODE'].map(IBGE_TO_SIGLA)
-        summary['Region'] = summary['IBGE_CODE'].map(IBGE_TO_REGION)
-        summary['Cognitive_Global_Mean'] = summary[['Math', 'Read', 'Science']].mean(axis=1)
-        summary = summary.sort_values(by='Cognitive_Global_Mean', ascending=False)  # <--- ORDENAÇÃO
-        summary = summary[['Region', 'UF', 'Math', 'Read', 'Science', 'Cognitive_Global_Mean']]
+        # Aggregation (Polars lazy: drop nulls + group_by in one multi-threaded pass)
+        scores_by_domain = {
+            name: next((c for c in df.columns if c.startswith('PV1') and key in c), None)
+            for name, key in [('Math', 'MATH'), ('Read', 'READ'), ('Science', 'SCIE')]
+        }
+        # Scores in [0, 1000]: float32 halves the bytes scanned by the group_by
+        score_cols = list(scores_by_domain.values())
+        df[score_cols] = df[score_cols].astype(np.float32)
+        summary = (
+            pl.from_pandas(df[['IBGE_CODE'] + score_cols])
+            .lazy()
+            .drop_nulls('IBGE_CODE')
+            .with_columns(pl.col('IBGE_CODE').cast(pl.Int32))
+            .group_by('IBGE_CODE')
+            .agg([pl.col(src).cast(pl.Float64).mean().alias(name) for name, src in scores_by_domain.items()])
+            .with_columns(
+                pl.col('IBGE_CODE').replace_strict(IBGE_TO_SIGLA, default=None).alias('UF'),
+                pl.col('IBGE_CODE').replace_strict(IBGE_TO_REGION, default=None).alias('Region'),
+                pl.mean_horizontal('Math', 'Read', 'Science').alias('Cognitive_Global_Mean')
+            )
+            .sort('Cognitive_Global_Mean', descending=True)  # <--- ORDENAÇÃO
+            .select(['Region', 'UF', 'Math', 'Read', 'Science', 'Cognitive_Global_Mean'])
+            .collect()
+            .to_pandas()
+        )
 
         # SafeGuard
         if DataGuard:
@@ -173,13 +214,17 @@ def process_pisa_2015():
 
         # Save Outputs
         out_csv = os.path.join(CSV_DIR, 'pisa_2015_states.csv')
+        out_parquet = os.path.join(CSV_DIR, 'pisa_2015_states.parquet')
         out_xlsx = os.path.join(XLSX_DIR, 'pisa_2015_states.xlsx')
         
         summary.to_csv(out_csv, index=False)
-        summary.to_excel(out_xlsx, index=False)
+        summary.to_parquet(out_parquet, engine='pyarrow', compression='zstd', compression_level=9, index=False)
+        with pd.ExcelWriter(out_xlsx, engine='xlsxwriter') as writer:
+            summary.to_excel(writer, index=False)
         
         print(f"[SUCCESS] Reports Generated:")
         print(f"          CSV:  {out_csv}")
+        print(f"          PARQUET: {out_parquet}")
         print(f"          XLSX: {out_xlsx}")
 
     except Exception as e:
@@ -32,7 +32,7 @@ TABLE CONTENT:
     - Student_Count: Sample size (N) per geographic unit.
 
 DEPENDENCIES:
-    pandas, numpy, pyreadstat, openpyxl, pathlib
+    pandas, numpy, pyreadstat, xlsxwriter, pathlib
 ================================================================================
 """
 
@@ -69,6 +69,33 @@ NAME_TO_IBGE = {
 }
 IBGE_TO_SIGLA = {11:'RO', 12:'AC', 13:'AM', 14:'RR', 15:'PA', 16:'AP', 17:'TO', 21:'MA', 22:'PI', 23:'CE', 24:'RN', 25:'PB', 26:'PE', 27:'AL', 28:'SE', 29:'BA', 31:'MG', 32:'ES', 33:'RJ', 35:'SP', 41:'PR', 42:'SC', 43:'RS', 50:'MS', 51:'MT', 52:'GO', 53:'DF'}
 
+def ibge_code_for(label):
+    """Longest state name found anywhere in the label wins ('MATO GROSSO DO SUL' over 'MATO GROSSO')."""
+    hits = [n for n in NAME_TO_IBGE if n in label]
+    return NAME_TO_IBGE[max(hits, key=len)] if hits else np.nan
+
+# Stratum keyword -> region, in priority order (first keyword found in the label wins)
+REGION_RULES = [
+    ('NORTE', 'North'), ('NORDESTE', 'Northeast'), ('SUDESTE', 'Southeast'),
+    ('SUL', 'South'), ('CENTRO', 'Center-West')
+]
+
+def read_brazil_rows(sav_path, cols, brazil_values, apply_value_formats=False):
+    """Streams the SAV in chunks and keeps only Brazil rows; the international file is never fully loaded."""
+    reader = pyreadstat.read_file_in_chunks(
+        pyreadstat.read_sav, str(sav_path), chunksize=50_000, usecols=cols,
+        apply_value_formats=apply_value_formats, formats_as_category=apply_value_formats
+    )
+    keep = []
+    for chunk, _ in reader:
+        # Low-cardinality CNT: match the category labels once, broadcast through the integer codes
+        cnt = chunk['CNT'].astype('category')
+        is_bra = np.append(cnt.cat.categories.isin(brazil_values), False)
+        chunk = chunk[is_bra[cnt.cat.codes.to_numpy()]]
+        if not chunk.empty: keep.append(chunk)
+    # Concat of pre-filtered chunks is already a fresh frame: no defensive copy needed
+    return pd.concat(keep, ignore_index=True) if keep else pd.DataFrame(columns=cols)
+
 # --- 3. ETL CORE CLASS ---
 class PisaUnifiedETL:
     
@@ -79,13 +106,24 @@ class PisaUnifiedETL:
         if not target_file: 
             print("[ERROR] 2015 raw file not found."); return
 
-        df, meta = pyreadstat.read_sav(str(target_file))
-        df = df[df['CNT'] == 'BRA'].copy()
+        # Header parsed once (metadata only) for the STRATUM labels; data read for the needed columns only,
+        # decoded in parallel row ranges
+        _, meta = pyreadstat.read_sav(str(target_file), metadataonly=True)
+        use_cols = ['CNT', 'STRATUM', 'PV1MATH', 'PV1READ', 'PV1SCIE']
+        df, _ = pyreadstat.read_file_multiprocessing(
+            pyreadstat.read_sav, str(target_file), num_processes=os.cpu_count(), usecols=use_cols,
+            disable_datetime_conversion=True
+        )
+        # Boolean selection already returns a new frame: no defensive copy
+        df = df.loc[(df['CNT'] == 'BRA').to_numpy()]
         labels = meta.variable_value_labels.get('STRATUM', {})
-        df['STRATUM_TEXT'] = df['STRATUM'].map(labels).fillna(df['STRATUM'].astype(str))
+        df = df.assign(STRATUM_TEXT=df['STRATUM'].map(labels).fillna(df['STRATUM'].astype(str)))
         
         # Mapping logic
-        df['IBGE_CODE'] = df['STRATUM_TEXT'].apply(lambda x: next((NAME_TO_IBGE[n] for n in sorted(NAME_TO_IBGE.keys(), key=len, reverse=True) if n in str(x).upper()), None))
+        # Resolved once per distinct stratum label, broadcast by category code (trailing NaN = missing label)
+        strat = df['STRATUM_TEXT'].astype('category')
+        code_lut = np.array([ibge_code_for(c) for c in strat.cat.categories.astype(str).str.upper()] + [np.nan])
+        df['IBGE_CODE'] = code_lut[strat.cat.codes.to_numpy()]
         df = df.dropna(subset=['IBGE_CODE'])
         
         summary = df.groupby('IBGE_CODE')[['PV1MATH', 'PV1READ', 'PV1SCIE']].mean().reset_index()
@@ -96,7 +134,8 @@ class PisaUnifiedETL:
         
         # Final Exports
         df_final.to_csv(DATA_PROCESSED_DIR / 'pisa_2015_states.csv', index=False)
-        df_final.to_excel(REPORT_DIR / 'pisa_2015_states.xlsx', index=False)
+        with pd.ExcelWriter(REPORT_DIR / 'pisa_2015_states.xlsx', engine='xlsxwriter') as writer:
+            df_final.to_excel(writer, index=False)
         print("[SUCCESS] Exported PISA 2015.")
 
     def run_2018(self):
@@ -105,23 +144,26 @@ class PisaUnifiedETL:
         if not file_path.exists(): 
             print("[ERROR] 2018 raw file not found."); return
 
-        df = pd.read_spss(str(file_path), usecols=['CNT', 'STRATUM', 'PV1MATH', 'PV1READ', 'PV1SCIE'], convert_categoricals=False)
-        df = df[df['CNT'].astype(str).str.contains('BRA|76')].copy()
+        df = read_brazil_rows(file_path, ['CNT', 'STRATUM', 'PV1MATH', 'PV1READ', 'PV1SCIE'], ['BRA', 76])
         
         mapping = {'01':'North', '02':'Northeast', '03':'Southeast', '04':'South', '05':'Center-West'}
-        df['Region'] = df['STRATUM'].apply(lambda x: mapping.get(str(x).upper()[3:5], 'UNKNOWN'))
+        # Region decoded once per distinct stratum label and broadcast by category code (trailing slot = missing)
+        strat = df['STRATUM'].astype('category')
+        region_lut = strat.cat.categories.astype(str).str.upper().str[3:5].map(mapping).fillna('UNKNOWN')
+        df['Region'] = np.append(region_lut.to_numpy(), 'UNKNOWN')[strat.cat.codes.to_numpy()]
         df = df[df['Region'] != 'UNKNOWN']
         
         means = df.groupby('Region')[['PV1MATH', 'PV1READ', 'PV1SCIE']].mean().reset_index()
         counts = df.groupby('Region').size().reset_index(name='Student_Count')
         
         res = pd.merge(counts, means, on='Region')
-        res['Cognitive_Global_Mean'] = res[['PV1MATH', 'PV1READ', 'PV1SCIE']].mean(axis=1)
+        res['Cognitive_Global_Mean'] = np.nanmean(res[['PV1MATH', 'PV1READ', 'PV1SCIE']].to_numpy(), axis=1)
         df_final = res.rename(columns={'PV1MATH': 'Math_Mean', 'PV1READ': 'Read_Mean', 'PV1SCIE': 'Science_Mean'}).round(2).sort_values('Cognitive_Global_Mean', ascending=False)
         
         # Final Exports
         df_final.to_csv(DATA_PROCESSED_DIR / 'pisa_2018_regional_summary.csv', index=False)
-        df_final.to_excel(REPORT_DIR / 'pisa_2018_regional_summary.xlsx', index=False)
+        with pd.ExcelWriter(REPORT_DIR / 'pisa_2018_regional_summary.xlsx', engine='xlsxwriter') as writer:
+            df_final.to_excel(writer, index=False)
         print("[SUCCESS] Exported PISA 2018.")
 
     def run_2022(self):
@@ -130,26 +172,29 @@ class PisaUnifiedETL:
         if not file_path.exists(): 
             print("[ERROR] 2022 raw file not found."); return
 
-        df = pd.read_spss(str(file_path), usecols=['CNT', 'STRATUM', 'PV1MATH', 'PV1READ', 'PV1SCIE'])
-        df = df[df['CNT'].astype(str).str.contains('Brazil')].copy()
-        
-        def get_reg(s):
-            s = str(s).upper()
-            return 'North' if 'NORTE' in s else 'Northeast' if 'NORDESTE' in s else 'Southeast' if 'SUDESTE' in s else 'South' if 'SUL' in s else 'Center-West' if 'CENTRO' in s else 'UNKNOWN'
+        df = read_brazil_rows(file_path, ['CNT', 'STRATUM', 'PV1MATH', 'PV1READ', 'PV1SCIE'], ['Brazil'], apply_value_formats=True)
         
-        df['Region'] = df['STRATUM'].apply(get_reg)
-        df = df[df['Region'] != 'UNKNOWN']
+        # Region resolved once per distinct STRATUM category, then broadcast to students by code
+        strata = df['STRATUM'].astype('category')
+        labels = pd.Series(strata.cat.categories.astype(str).str.upper())
+        region_lut = np.select(
+            [labels.str.contains(k, regex=False) for k, _ in REGION_RULES],
+            [r for _, r in REGION_RULES], default=None
+        )
+        df['Region'] = np.append(region_lut, None)[strata.cat.codes.to_numpy()]
+        df = df.dropna(subset=['Region'])
         
         means = df.groupby('Region')[['PV1MATH', 'PV1READ', 'PV1SCIE']].mean().reset_index()
         counts = df.groupby('Region').size().reset_index(name='Student_Count')
         
         res = pd.merge(counts, means, on='Region')
-        res['Cognitive_Global_Mean'] = res[['PV1MATH', 'PV1READ', 'PV1SCIE']].mean(axis=1)
+        res['Cognitive_Global_Mean'] = np.nanmean(res[['PV1MATH', 'PV1READ', 'PV1SCIE']].to_numpy(), axis=1)
         df_final = res.rename(columns={'PV1MATH': 'Math_Mean', 'PV1READ': 'Read_Mean', 'PV1SCIE': 'Science_Mean'}).round(2).sort_values('Cognitive_Global_Mean', ascending=False)
         
         # Final Exports
         df_final.to_csv(DATA_PROCESSED_DIR / 'pisa_2022_regional_summary.csv', index=False)
-        df_final.to_excel(REPORT_DIR / 'pisa_2022_regional_summary.xlsx', index=False)
+        with pd.ExcelWriter(REPORT_DIR / 'pisa_2022_regional_summary.xlsx', engine='xlsxwriter') as writer:
+            df_final.to_excel(writer, index=False)
         print("[SUCCESS] Exported PISA 2022.")
 
 # --- 4. EXECUTION FLOW ---
@@ -17,11 +17,19 @@ DESCRIPTION:
 
 import pandas as pd
 import numpy as np
+import polars as pl
+import pyarrow as pa
+import pyarrow.csv as pacsv
+import pyarrow.parquet as pq
+import functools
 import os
+import shutil
 import zipfile
 import sys
 import logging
+import multiprocessing
 import time
+from concurrent.futures import ProcessPoolExecutor
 
 # --- WINDOWS TIMEOUT INPUT ---
 try:
@@ -52,8 +60,10 @@ DATA_RAW = os.path.join(BASE_PATH, 'data', 'raw')
 DATA_PROCESSED = os.path.join(BASE_PATH, 'data', 'processed')
 REPORT_XLSX = os.path.join(BASE_PATH, 'reports', 'varcog', 'xlsx')
 LOG_DIR = os.path.join(BASE_PATH, 'logs')
+DATA_TMP = os.path.join(BASE_PATH, 'data', 'tmp')
+DATA_CACHE = os.path.join(BASE_PATH, 'data', 'cache')
 
-for p in [DATA_RAW, DATA_PROCESSED, REPORT_XLSX, LOG_DIR]:
+for p in [DATA_RAW, DATA_PROCESSED, REPORT_XLSX, LOG_DIR, DATA_TMP, DATA_CACHE]:
     os.makedirs(p, exist_ok=True)
 
 # --- STANDARD TARGET NAMES ---
@@ -77,6 +87,79 @@ UF_REGION_MAP = {
     'PR': 'South', 'SC': 'South', 'RS': 'South',
     'MS': 'Center-West', 'MT': 'Center-West', 'GO': 'Center-West', 'DF': 'Center-West'
 }
+# Fixed 27-UF dictionary: category codes index the region lookup below
+UF_DTYPE = pd.CategoricalDtype(list(UF_REGION_MAP))
+# Region per UF code: indexed lookup into a precomputed array instead of a per-row dict map
+REGION_DTYPE = pd.CategoricalDtype(list(dict.fromkeys(UF_REGION_MAP.values())))
+UF_REGION_CODES = REGION_DTYPE.categories.get_indexer(list(UF_REGION_MAP.values()))
+SCORE_COLS = ['Natural_Sciences', 'Humanities', 'Language', 'Math', 'Essay']
+
+def is_valid_cache(cache_path, zip_path):
+    """Cache is reused only if newer than the ZIP and written with this script's column names (UF mandatory)."""
+    if not os.path.exists(cache_path) or os.path.getmtime(cache_path) <= os.path.getmtime(zip_path):
+        return False
+    names = pq.read_schema(cache_path).names
+    return 'UF' in names and set(names) <= set(TARGET_COLS)
+
+def cache_enem_parquet(csv_path, sep, col_map, cache_path):
+    """
+    Writes the needed ENEM columns once to a typed, zstd-compressed Parquet file (streaming sink),
+    renamed to the standard target names. Later runs scan it instead of re-parsing the latin-1 CSV.
+    """
+    def typed(raw, name):
+        col = pl.col(raw).str.strip_chars()
+        if name == 'UF': return col.alias(name)
+        # float32 scores on disk (upcast to Float64 before any sum in aggregate_enem_polars), int8 codes
+        return col.cast(pl.Float32 if name in SCORE_COLS else pl.Int8, strict=False).alias(name)
+
+    # Everything read as text (no schema inference over the whole file); only the needed columns are cast
+    tmp_path = cache_path + '.part'
+    (pl.scan_csv(csv_path, separator=sep, encoding='utf8-lossy', infer_schema=False, low_memory=True)
+       .select([typed(raw, name) for raw, name in col_map.items()])
+       .sink_parquet(tmp_path, compression='zstd'))
+    os.replace(tmp_path, cache_path)
+
+def aggregate_enem_polars(lf, has_status_col):
+    """
+    Single lazy Polars pass over the cached ENEM columns (streaming engine): 3EM filter, 0 -> null on scores,
+    Mean_General, Is_Public and per-UF sum / count / sum of squares.
+    Returns a pandas frame indexed by UF, keyed like the consolidation step expects.
+    """
+    present = set(lf.collect_schema().names())
+    score_cols = [c for c in SCORE_COLS if c in present]
+    num = lambda c: pl.col(c).cast(pl.Float64, strict=False)
+
+    # The STATUS filter is pushed down into the Parquet scan
+    if has_status_col:
+        lf = lf.filter(num('STATUS') == 2)
+    lf = lf.with_columns([pl.when(num(c) != 0).then(num(c)).alias(c) for c in score_cols])
+
+    # Public/Private Map (Hybrid Logic): TP_ESCOLA 2=Pub, 3=Priv | TP_DEPENDENCIA_ADM_ESC 1,2,3=Pub, 4=Priv
+    if 'SCHOOL_TYPE' in present:
+        is_public = pl.when(num('SCHOOL_TYPE') == 2).then(1.0).when(num('SCHOOL_TYPE') == 3).then(0.0)
+    elif 'SCHOOL_DEP' in present:
+        is_public = pl.when(num('SCHOOL_DEP').is_in([1, 2, 3])).then(1.0).when(num('SCHOOL_DEP') == 4).then(0.0)
+    else:
+        is_public = pl.lit(None, dtype=pl.Float64)
+    mean_general = pl.mean_horizontal(score_cols) if score_cols else pl.lit(None, dtype=pl.Float64)
+    lf = lf.with_columns(mean_general.alias('Mean_General'), is_public.alias('Is_Public'))
+
+    target_cols = score_cols + ['Mean_General']
+    aggs = [pl.len().alias('Rows')]
+    for c in target_cols:
+        aggs += [pl.col(c).sum().alias(f'{c}__sum'), pl.col(c).count().alias(f'{c}__count'), (pl.col(c) ** 2).sum().alias(f'{c}_sq')]
+    aggs += [pl.col('Is_Public').sum().alias('Public_Sum'), pl.col('Is_Public').count().alias('Network_Valid_Count')]
+
+    res = (lf.filter(pl.col('UF').is_in(list(UF_REGION_MAP)))
+             .group_by('UF').agg(aggs)
+             .collect(engine='streaming')
+             .to_pandas().set_index('UF'))
+    return res.rename(columns={f'{c}__{k}': (c, k) for c in target_cols for k in ('sum', 'count')})
+
+# Upper-cased header lookup, built once per header (tuple) and reused by every search
+@functools.lru_cache(maxsize=8)
+def header_index(header):
+    return {h.upper(): h for h in header}
 
 class EnemPipeline:
     def __init__(self, year, file_path):
@@ -96,9 +179,22 @@ class EnemPipeline:
         if not csv_files: return None
         return sorted(csv_files, key=lambda x: z.getinfo(x).file_size, reverse=True)[0]
 
+    def extract_member(self, z, target):
+        """Extracts the microdata CSV once to data/tmp (Polars scans a file path) and reuses it while newer than the ZIP."""
+        out_path = os.path.join(DATA_TMP, f"enem_{self.year}_{os.path.basename(target.filename)}")
+        if os.path.exists(out_path) and os.path.getmtime(out_path) > os.path.getmtime(self.file_path):
+            print("   [CACHE] Reusing extracted CSV.")
+            return out_path
+
+        tmp_path = out_path + '.part'
+        with z.open(target) as src, open(tmp_path, 'wb') as dst:
+            shutil.copyfileobj(src, dst, length=16 << 20)
+        os.replace(tmp_path, out_path)
+        return out_path
+
     def find_col_flexible(self, header, candidates):
         """Helper to find column names case-insensitively."""
-        header_upper = {h.upper(): h for h in header}
+        header_upper = header_index(tuple(header))
         for cand in candidates:
             if cand.upper() in header_upper:
                 return header_upper[cand.upper()]
@@ -108,126 +204,64 @@ class EnemPipeline:
         print(f"\n[INFO] Processing ENEM {self.year}...")
         self.logger.info(f"START ENEM {self.year} | File: {self.file_path}")
         
+        cache_path = os.path.join(DATA_CACHE, f"enem_triennium_{self.year}.parquet")
         try:
-            with zipfile.ZipFile(self.file_path, 'r') as z:
-                target_filename = self.get_largest_csv(z)
-                if not target_filename:
-                    print(f"   [ERROR] No CSV found."); return
-
-                with z.open(target_filename) as f:
-                    # 1. Detect Separator & Read Header
-                    first_line = f.readline().decode('latin-1')
-                    sep = ';' if first_line.count(';') > first_line.count(',') else ','
-                    f.seek(0)
-                    
-                    header = pd.read_csv(f, sep=sep, encoding='latin-1', nrows=0).columns.tolist()
-                    if len(header) < 2:
-                        sep = ',' if sep == ';' else ';'
-                        f.seek(0)
-                        header = pd.read_csv(f, sep=sep, encoding='latin-1', nrows=0).columns.tolist()
-                    
-                    print(f"   [DEBUG] Headers found (Top 5): {header[:5]}")
-
-                    # 2. Map Actual Columns to Target Columns
-                    col_map = {} 
-                    missing_critical = []
-                    
-                    for internal_name, candidates in TARGET_COLS.items():
-                        found = self.find_col_flexible(header, candidates)
-                        if found:
-                            col_map[found] = internal_name
-                        else:
-                            # Strict check only for UF. Others are adaptable.
-                            if internal_name in ['UF']:
-                                missing_critical.append(internal_name)
-                    
-                    if missing_critical:
-                        print(f"   [CRITICAL ERROR] Missing mandatory columns: {missing_critical}")
-                        return
-
-                    # 3. Process Data
-                    cols_to_load = list(col_map.keys())
-                    chunk_size = 250000 
-                    agg_storage = [] 
-                    
-                    f.seek(0)
-                    reader = pd.read_csv(f, sep=sep, encoding='latin-1', usecols=cols_to_load, chunksize=chunk_size)
-                    
-                    batch_idx = 0
-                    total_rows = 0
-                    filtered_rows = 0
-                    has_status_col = 'STATUS' in col_map.values()
-                    
-                    if not has_status_col:
-                        print("   [WARN] 'TP_ST_CONCLUSAO' not found. 3EM Filter DISABLED (Processing ALL).")
-
-                    for chunk in reader:
-                        batch_idx += 1
-                        total_rows += len(chunk)
-                        
-                        # Rename to Standard Internal Names
-                        chunk = chunk.rename(columns=col_map)
-                        
-                        # --- FILTER: ONLY 3EM (If column exists) ---
-                        if has_status_col:
-                            chunk = chunk[chunk['STATUS'] == 2].copy()
-                        
-                        filtered_rows += len(chunk)
-                        if chunk.empty: continue
-
-                        if batch_idx % 10 == 0:
-                            print(f"   ... Processed {total_rows/1e6:.1f}M rows (Active: {filtered_rows/1e6:.1f}M)", end='\r')
-
-                        # 4. Clean Scores (0 -> NaN)
-                        score_cols = ['Natural_Sciences', 'Humanities', 'Language', 'Math', 'Essay']
-                        present_scores = [c for c in score_cols if c in chunk.columns]
-                        
-                        if present_scores:
-                            chunk[present_scores] = chunk[present_scores].replace(0, np.nan)
-                            chunk['Mean_General'] = chunk[present_scores].mean(axis=1)
-                        else:
-                            chunk['Mean_General'] = np.nan
-
-                        target_cols = present_scores + ['Mean_General']
-
-                        # 5. Public/Private Map (Hybrid Logic)
-                        # Option A: Standard SCHOOL_TYPE (TP_ESCOLA) -> 2=Pub, 3=Priv
-                        if 'SCHOOL_TYPE' in chunk.columns:
-                            conditions = [chunk['SCHOOL_TYPE'].isin([2]), chunk['SCHOOL_TYPE'].isin([3])]
-                            choices = [1, 0] 
-                            chunk['Is_Public'] = np.select(conditions, choices, default=np.nan)
-                        
-                        # Option B: Dependency SCHOOL_DEP (TP_DEPENDENCIA_ADM_ESC) -> 1,2,3=Pub, 4=Priv
-                        elif 'SCHOOL_DEP' in chunk.columns:
-                             # 1=Federal, 2=Estadual, 3=Municipal -> PUBLIC (1)
-                             # 4=Privada -> PRIVATE (0)
-                            conditions = [chunk['SCHOOL_DEP'].isin([1, 2, 3]), chunk['SCHOOL_DEP'] == 4]
-                            choices = [1, 0]
-                            chunk['Is_Public'] = np.select(conditions, choices, default=np.nan)
-                            
-                        else:
-                            chunk['Is_Public'] = np.nan
-
-                        # 6. Aggregation
-                        sq_cols = chunk[target_cols].pow(2)
-                        sq_cols.columns = [f"{c}_sq" for c in target_cols]
-                        chunk_sq = pd.concat([chunk[['UF']], sq_cols], axis=1)
-                        
-                        g_scores = chunk.groupby('UF')[target_cols].agg(['sum', 'count'])
-                        g_sq = chunk_sq.groupby('UF')[[c for c in chunk_sq.columns if '_sq' in c]].sum()
-                        g_net = chunk.groupby('UF')['Is_Public'].agg(['sum', 'count'])
-                        g_net.columns = ['Public_Sum', 'Network_Valid_Count']
-
-                        chunk_res = pd.concat([g_scores, g_sq, g_net], axis=1)
-                        agg_storage.append(chunk_res)
+            if is_valid_cache(cache_path, self.file_path):
+                print("   [CACHE] Reusing Parquet column cache (ZIP not read).")
+            else:
+                # 1. Extract the member once (a single decompression pass); the header is read from the extracted file
+                with zipfile.ZipFile(self.file_path, 'r') as z:
+                    target_filename = self.get_largest_csv(z)
+                    if not target_filename:
+                        print(f"   [ERROR] No CSV found."); return
+                    csv_path = self.extract_member(z, z.getinfo(target_filename))
+
+                # 2. Detect Separator & Read Header
+                with open(csv_path, 'rb') as f:
+                    first_line = f.readline().decode('latin-1').rstrip('\r\n')
+                sep = ';' if first_line.count(';') > first_line.count(',') else ','
+                header = tuple(h.strip().strip('"') for h in first_line.split(sep))
+                if len(header) < 2:
+                    sep = ',' if sep == ';' else ';'
+                    header = tuple(h.strip().strip('"') for h in first_line.split(sep))
+
+                print(f"   [DEBUG] Headers found (Top 5): {header[:5]}")
+
+                # 3. Map Actual Columns to Target Columns
+                col_map = {} 
+                missing_critical = []
+
+                for internal_name, candidates in TARGET_COLS.items():
+                    found = self.find_col_flexible(header, candidates)
+                    if found:
+                        col_map[found] = internal_name
+                    else:
+                        # Strict check only for UF. Others are adaptable.
+                        if internal_name in ['UF']:
+                            missing_critical.append(internal_name)
+
+                if missing_critical:
+                    print(f"   [CRITICAL ERROR] Missing mandatory columns: {missing_critical}")
+                    return
+
+                # 4. Cache the needed columns as Parquet (later runs skip the ZIP)
+                cache_enem_parquet(csv_path, sep, col_map, cache_path)
+                os.remove(csv_path)  # superseded by the Parquet cache
+
+            # 5. Process Data: one lazy Polars aggregation over the Parquet cache
+            lf = pl.scan_parquet(cache_path)
+            has_status_col = 'STATUS' in lf.collect_schema().names()
+            if not has_status_col:
+                print("   [WARN] 'TP_ST_CONCLUSAO' not found. 3EM Filter DISABLED (Processing ALL).")
+            full_agg = aggregate_enem_polars(lf, has_status_col)
+            print(f"   ... Active rows: {int(full_agg['Rows'].sum())/1e6:.1f}M")
 
             # --- CONSOLIDATION ---
-            if not agg_storage:
+            if full_agg.empty:
                 print("\n   [WARN] No data found.")
                 return
 
             print(f"\n   [INFO] Consolidating metrics...")
-            full_agg = pd.concat(agg_storage).groupby(level=0).sum()
             final_df = pd.DataFrame(index=full_agg.index)
             
             # Recalculate
@@ -254,7 +288,7 @@ class EnemPipeline:
             
             # --- SAVING ---
             final_df = final_df.reset_index()
-            final_df['Region'] = final_df['UF'].map(UF_REGION_MAP)
+            final_df['Region'] = pd.Categorical.from_codes(UF_REGION_CODES[final_df['UF'].astype(UF_DTYPE).cat.codes], dtype=REGION_DTYPE)
             final_df['Year'] = str(self.year)
             
             # Tag adjustment: if filtering was possible, mark as 3EM, else ALL
@@ -267,8 +301,13 @@ class EnemPipeline:
             csv_path = os.path.join(DATA_PROCESSED, f"{fname}.csv")
             xlsx_path = os.path.join(REPORT_XLSX, f"{fname}.xlsx")
             
-            final_df.to_csv(csv_path, index=False)
-            final_df.to_excel(xlsx_path, index=False)
+            # One Arrow table feeds both the C++ CSV writer and the columnar copy
+            # (the panel builder prefers the .parquet sibling)
+            table = pa.Table.from_pandas(final_df, preserve_index=False)
+            pacsv.write_csv(table, csv_path, write_options=pacsv.WriteOptions(quoting_style='none'))
+            pq.write_table(table, os.path.join(DATA_PROCESSED, f"{fname}.parquet"), compression='zstd')
+            with pd.ExcelWriter(xlsx_path, engine='xlsxwriter') as writer:
+                final_df.to_excel(writer, index=False)
             
             print(f"   -> Saved: {fname}.xlsx")
             self.logger.info(f"SUCCESS. Saved {fname}")
@@ -279,8 +318,14 @@ class EnemPipeline:
             import traceback
             traceback.print_exc()
 
+def run_year(task):
+    """Worker: processes one year (top-level so the ProcessPoolExecutor can pickle it)."""
+    year, path = task
+    EnemPipeline(year, path).process()
+
 def main():
-    os.system('cls' if os.name == 'nt' else 'clear')
+    if os.name == 'nt': os.system('')  # enable ANSI escape handling on the Windows console
+    print('\033[2J\033[H', end='', flush=True)
     print("=== ENEM UNIFIED PIPELINE v3.1 (Adaptive 2024) ===")
     
     raw = input_timeout(">> Years (e.g. 2024)", timeout=5, default="2015, 2018, 2022, 2023, 2024")
@@ -292,6 +337,7 @@ def main():
     print(f"\n[QUEUE] Processing: {years}")
     print("-" * 50)
 
+    tasks = []
     for y in years:
         default_path = os.path.join(DATA_RAW, f"microdados_enem_{y}.zip")
         final_path = None
@@ -304,8 +350,19 @@ def main():
                 final_path = user_path
         
         if final_path:
-            pipeline = EnemPipeline(y, final_path)
-            pipeline.process()
+            tasks.append((y, final_path))
+
+    # Years are independent (separate ZIPs): one process per year.
+    # Each year already runs on Polars' thread pool, so workers stay at half the cores
+    # and the Polars threads are split between them (spawn: the child imports Polars with the limit set).
+    if len(tasks) > 1:
+        cpus = os.cpu_count() or 1
+        workers = min(len(tasks), max(1, cpus // 2))
+        os.environ.setdefault('POLARS_MAX_THREADS', str(max(1, cpus // workers)))
+        with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context('spawn')) as ex:
+            list(ex.map(run_year, tasks))
+    else:
+        for task in tasks: run_year(task)
 
     print("\n[DONE] Pipeline finished.")
 
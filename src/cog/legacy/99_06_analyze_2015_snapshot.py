@@ -24,6 +24,8 @@ OUTPUT:
 """
 
 import pandas as pd
+import matplotlib
+matplotlib.use('Agg')  # Headless backend: no GUI probing in batch runs
 import seaborn as sns
 import matplotlib.pyplot as plt
 import os
@@ -138,6 +140,7 @@ def main():
     
     out_img = os.path.join(REPORT_IMG, 'triangulation_2015_heatmap.png')
     plt.savefig(out_img, dpi=300)
+    plt.close()
     print(f"\n[OUTPUT] Heatmap saved: {out_img}")
 
     # 6. Save Merged Data for JASP
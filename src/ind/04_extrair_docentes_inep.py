@@ -43,7 +43,8 @@ def extrair_docentes_inep():
         file_csv = os.path.join(output_dir_csv, 'dados_qualificacao_docente_2022.csv')
         
         # MUDANCA: sheet_name
-        df.to_excel(file_xlsx, index=False, sheet_name='DOCENTES_2022')
+        with pd.ExcelWriter(file_xlsx, engine='xlsxwriter') as writer:
+            df.to_excel(writer, index=False, sheet_name='DOCENTES_2022')
         df.to_csv(file_csv, index=False, sep=';', encoding='utf-8-sig')
 
         print(f"Exportacao concluida (Aba: DOCENTES_2022):\n   {file_xlsx}")
@@ -108,7 +108,8 @@ def processar_dados_ibge():
 
     # Exportar Excel e CSV
     df_final.to_csv(caminho_saida_csv, index=False, sep=';', decimal=',', encoding='utf-8-sig')
-    df_final.to_excel(caminho_saida_xlsx, index=False)
+    with pd.ExcelWriter(caminho_saida_xlsx, engine='xlsxwriter') as writer:
+        df_final.to_excel(writer, index=False)
 
     print(f">>> Processamento concluído.")
     print(f"Arquivos gerados:\n - {caminho_saida_csv}\n - {caminho_saida_xlsx}")
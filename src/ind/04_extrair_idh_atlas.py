@@ -52,7 +52,8 @@ def extrair_idh_atlas():
         file_xlsx = os.path.join(output_dir_xlsx, 'dados_idh_atlas_2021.xlsx')
         file_csv = os.path.join(output_dir_csv, 'dados_idh_atlas_2021.csv')
         
-        df.to_excel(file_xlsx, index=False, sheet_name='IDH_2021')
+        with pd.ExcelWriter(file_xlsx, engine='xlsxwriter') as writer:
+            df.to_excel(writer, index=False, sheet_name='IDH_2021')
         df.to_csv(file_csv, index=False, sep=';', encoding='utf-8-sig')
 
         print(f"Exportacao concluida (Aba: IDH_2021):\n   {file_xlsx}")
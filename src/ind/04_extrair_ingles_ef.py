@@ -43,7 +43,8 @@ def extrair_ingles_ef():
         file_xlsx = os.path.join(output_dir_xlsx, 'dados_ingles_ef_2022.xlsx')
         file_csv = os.path.join(output_dir_csv, 'dados_ingles_ef_2022.csv')
         
-        df.to_excel(file_xlsx, index=False, sheet_name='INGLES_2022')
+        with pd.ExcelWriter(file_xlsx, engine='xlsxwriter') as writer:
+            df.to_excel(writer, index=False, sheet_name='INGLES_2022')
         df.to_csv(file_csv, index=False, sep=';', encoding='utf-8-sig')
 
         print(f"Exportacao concluida (Aba: INGLES_2022):\n   {file_xlsx}")
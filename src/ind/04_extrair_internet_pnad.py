@@ -44,7 +44,8 @@ def extrair_internet_pnad():
         file_xlsx = os.path.join(output_dir_xlsx, 'dados_internet_pnad_2022.xlsx')
         file_csv = os.path.join(output_dir_csv, 'dados_internet_pnad_2022.csv')
         
-        df.to_excel(file_xlsx, index=False, sheet_name='INTERNET_2022')
+        with pd.ExcelWriter(file_xlsx, engine='xlsxwriter') as writer:
+            df.to_excel(writer, index=False, sheet_name='INTERNET_2022')
         df.to_csv(file_csv, index=False, sep=';', encoding='utf-8-sig')
 
         print(f"Exportacao concluida (Aba: INTERNET_2022):\n   {file_xlsx}")
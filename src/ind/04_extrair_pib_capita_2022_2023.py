@@ -96,7 +96,8 @@ caminho_xlsx = os.path.join(diretorio_atual, 'data', 'raw', 'media_pib_per_capit
 os.makedirs(os.path.dirname(caminho_csv), exist_ok=True)
 
 df_final.to_csv(caminho_csv, index=False, encoding='utf-8-sig', sep=';', decimal=',')
-df_final.to_excel(caminho_xlsx, index=False)
+with pd.ExcelWriter(caminho_xlsx, engine='xlsxwriter') as writer:
+    df_final.to_excel(writer, index=False)
 
 print(f"\nArquivos gerados com sucesso:\nCSV: {caminho_csv}\nXLSX: {caminho_xlsx}")
 print(df_final.head())
\ No newline at end of file
@@ -79,7 +79,8 @@ def consolidar_indicadores():
         path_xlsx = os.path.join(output_dir, 'base_mestra_indicadores_completa.xlsx')
         path_csv = os.path.join(output_dir, 'base_mestra_indicadores_completa.csv')
         
-        df_consolidado.to_excel(path_xlsx, index=False, sheet_name='BASE_COMPLETA')
+        with pd.ExcelWriter(path_xlsx, engine='xlsxwriter') as writer:
+            df_consolidado.to_excel(writer, index=False, sheet_name='BASE_COMPLETA')
         df_consolidado.to_csv(path_csv, index=False, sep=';', encoding='utf-8-sig')
         
         print(f"\nCONSOLIDACAO CONCLUIDA!")
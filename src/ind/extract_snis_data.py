@@ -198,7 +198,8 @@ def extract_snis_data():
             file_xlsx = os.path.join(output_dir_xlsx, 'sanitation_indicators_2022.xlsx')
             file_csv = os.path.join(output_dir_csv, 'sanitation_indicators_2022.csv')
             
-            df_final.to_excel(file_xlsx, index=False, sheet_name='SNIS_2022')
+            with pd.ExcelWriter(file_xlsx, engine='xlsxwriter') as writer:
+                df_final.to_excel(writer, index=False, sheet_name='SNIS_2022')
             df_final.to_csv(file_csv, index=False, sep=';', encoding='utf-8-sig')
             
             generate_report_visuals(df_final)
@@ -28,11 +28,19 @@ DESCRIPTION:
 
 import pandas as pd
 import numpy as np
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.csv as pacsv
+import pyarrow.parquet as pq
+import functools
+import io
 import os
 import zipfile
 import sys
 import logging
+import multiprocessing
 import time
+from concurrent.futures import ProcessPoolExecutor
 
 # --- WINDOWS TIMEOUT INPUT ---
 try:
@@ -67,6 +75,11 @@ LOG_DIR = os.path.join(BASE_PATH, 'logs')
 for p in [DATA_RAW, DATA_PROCESSED, REPORT_XLSX, LOG_DIR]:
     os.makedirs(p, exist_ok=True)
 
+# 8 MiB reads over the ZipExtFile: fewer small inflate calls per CSV chunk
+ZIP_READ_BUFFER = 8 << 20
+# Minimum seconds between console progress updates (\r rewrites are slow on the Windows console)
+PROGRESS_INTERVAL = 1.0
+
 # --- STANDARD TARGET NAMES ---
 TARGET_COLS = {
     'UF': ['SG_UF_PROVA', 'UF_PROVA', 'SG_UF_ESC'], 
@@ -89,6 +102,45 @@ UF_REGION_MAP = {
     'PR': 'South', 'SC': 'South', 'RS': 'South',
     'MS': 'Center-West', 'MT': 'Center-West', 'GO': 'Center-West', 'DF': 'Center-West'
 }
+# Fixed 27-UF dictionary so every chunk shares the same category codes
+UF_DTYPE = pd.CategoricalDtype(list(UF_REGION_MAP))
+# Region per UF code: indexed lookup into a precomputed array instead of a per-row dict map
+REGION_DTYPE = pd.CategoricalDtype(list(dict.fromkeys(UF_REGION_MAP.values())))
+UF_REGION_CODES = REGION_DTYPE.categories.get_indexer(list(UF_REGION_MAP.values()))
+
+# --- PER-UF SCATTER KERNEL ---
+# numba is optional: with it, a JIT kernel walks each metric column in parallel; without it, a NumPy bincount path
+try:
+    from numba import njit, prange
+
+    @njit(parallel=True, cache=True)
+    def accumulate_state(codes, mat, sums, sqsums, counts):
+        n, k = mat.shape
+        for j in prange(k):  # one column per thread: no two threads touch the same cell
+            for i in range(n):
+                v = mat[i, j]
+                if not np.isnan(v):
+                    g = codes[i]
+                    sums[g, j] += v
+                    sqsums[g, j] += v * v
+                    counts[g, j] += 1
+except ImportError:
+    def accumulate_state(codes, mat, sums, sqsums, counts):
+        # One weighted bincount per metric column (much faster than np.add.at); NaN cells weigh 0 in all three,
+        # and the squares come from the same zero-filled block (no second full-size squared copy of the chunk)
+        n_uf = sums.shape[0]
+        valid = ~np.isnan(mat)
+        vals = np.where(valid, mat, 0.0)
+        for j in range(mat.shape[1]):
+            col = vals[:, j]
+            sums[:, j] += np.bincount(codes, weights=col, minlength=n_uf)
+            sqsums[:, j] += np.bincount(codes, weights=col * col, minlength=n_uf)
+            counts[:, j] += np.bincount(codes, weights=valid[:, j], minlength=n_uf).astype(np.int64)
+
+# Upper-cased header lookup, built once per header (tuple) and reused by every search
+@functools.lru_cache(maxsize=8)
+def header_index(header):
+    return {h.upper(): h for h in header}
 
 class EnemPipeline:
     def __init__(self, year, file_path):
@@ -109,7 +161,7 @@ class EnemPipeline:
         return sorted(csv_files, key=lambda x: z.getinfo(x).file_size, reverse=True)[0]
 
     def find_col_flexible(self, header, candidates):
-        header_upper = {h.upper(): h for h in header}
+        header_upper = header_index(tuple(header))
         for cand in candidates:
             if cand.upper() in header_upper:
                 return header_upper[cand.upper()]
@@ -125,17 +177,14 @@ class EnemPipeline:
                 if not target_filename:
                     print(f"   [ERROR] No CSV found."); return
 
-                with z.open(target_filename) as f:
-                    # 1. Detect Header
-                    first_line = f.readline().decode('latin-1')
+                with io.BufferedReader(z.open(target_filename), buffer_size=ZIP_READ_BUFFER) as f:
+                    # 1. Detect Header (peeked from the buffer: nothing consumed, no rewind of the zip stream)
+                    first_line = f.peek(1 << 16).split(b'\n', 1)[0].decode('latin-1').rstrip('\r')
                     sep = ';' if first_line.count(';') > first_line.count(',') else ','
-                    f.seek(0)
-                    
-                    header = pd.read_csv(f, sep=sep, encoding='latin-1', nrows=0).columns.tolist()
+                    header = tuple(h.strip().strip('"') for h in first_line.split(sep))
                     if len(header) < 2:
                         sep = ',' if sep == ';' else ';'
-                        f.seek(0)
-                        header = pd.read_csv(f, sep=sep, encoding='latin-1', nrows=0).columns.tolist()
+                        header = tuple(h.strip().strip('"') for h in first_line.split(sep))
                     
                     # 2. Map Columns
                     col_map = {} 
@@ -168,78 +217,105 @@ class EnemPipeline:
 
                     # 4. Load Data
                     cols_to_load = list(col_map.keys())
-                    chunk_size = 250000 
-                    agg_storage = [] 
+                    score_cols = ['Natural_Sciences', 'Humanities', 'Language', 'Math', 'Essay']
+                    present_scores = [c for c in score_cols if c in col_map.values()]
+                    metrics = present_scores + ['Mean_General', 'Is_Public']
+
+                    # Per-UF state over the fixed UF codes: one [UF x metric] matrix each for sum, sum of squares and count
+                    n_uf = len(UF_DTYPE.categories)
+                    uf_rows = np.zeros(n_uf, dtype=np.int64)
+                    sums = np.zeros((n_uf, len(metrics)))
+                    sqsums = np.zeros((n_uf, len(metrics)))
+                    counts = np.zeros((n_uf, len(metrics)), dtype=np.int64)
                     
-                    f.seek(0)
-                    reader = pd.read_csv(f, sep=sep, encoding='latin-1', usecols=cols_to_load, chunksize=chunk_size)
+                    # Arrow streaming CSV reader (multithreaded parse, 64 MiB blocks) with fixed column types:
+                    # scores as float32 (half the bytes per chunk; the sums below are still accumulated in float64),
+                    # codes as int8, UF dictionary-encoded (arrives in pandas as a categorical).
+                    # '0' is read as null on numeric columns (score 0 -> NaN; the TP_* codes have no 0 level).
+                    raw_of = {std: raw for raw, std in col_map.items()}
+                    col_types = {raw: pa.float32() if std in score_cols else pa.float64() if std == 'SCHOOL_ID'
+                                 else pa.dictionary(pa.int32(), pa.string()) if std == 'UF' else pa.int8()
+                                 for raw, std in col_map.items()}
+                    reader = pacsv.open_csv(
+                        f,
+                        read_options=pacsv.ReadOptions(encoding='latin-1', block_size=64 << 20),
+                        parse_options=pacsv.ParseOptions(delimiter=sep),
+                        convert_options=pacsv.ConvertOptions(include_columns=cols_to_load, column_types=col_types,
+                                                             null_values=['', '0', '0.0'])
+                    )
                     
-                    batch_idx = 0
                     total_rows = 0
                     filtered_rows = 0
+                    next_report = time.monotonic() + PROGRESS_INTERVAL
 
-                    for chunk in reader:
-                        batch_idx += 1
-                        total_rows += len(chunk)
+                    for batch in reader:
+                        total_rows += batch.num_rows
                         
-                        chunk = chunk.rename(columns=col_map)
-                        
-                        # --- METHODOLOGY IMPLEMENTATION ---
+                        # --- METHODOLOGY IMPLEMENTATION (filter applied on the Arrow batch) ---
                         if filter_mode == 'STRICT_3EM':
-                            chunk = chunk[chunk['STATUS'] == 2].copy()
+                            batch = batch.filter(pc.equal(batch.column(raw_of['STATUS']), 2))
                         elif filter_mode == 'PROXY_3EM':
-                            chunk = chunk[chunk['SCHOOL_ID'].notna()].copy()
+                            batch = batch.filter(pc.is_valid(batch.column(raw_of['SCHOOL_ID'])))
+                        
+                        chunk = batch.to_pandas().rename(columns=col_map)
+                        chunk['UF'] = chunk['UF'].astype(UF_DTYPE)
                         
                         filtered_rows += len(chunk)
                         if chunk.empty: continue
 
-                        if batch_idx % 10 == 0:
+                        # Time-based progress (at most once per PROGRESS_INTERVAL), not every N batches
+                        if time.monotonic() >= next_report:
                             print(f"   ... Processed {total_rows/1e6:.1f}M rows (Kept {filtered_rows/1e6:.1f}M)", end='\r')
-
-                        # 5. Clean Scores
-                        score_cols = ['Natural_Sciences', 'Humanities', 'Language', 'Math', 'Essay']
-                        present_scores = [c for c in score_cols if c in chunk.columns]
-                        
-                        if present_scores:
-                            chunk[present_scores] = chunk[present_scores].replace(0, np.nan)
-                            chunk['Mean_General'] = chunk[present_scores].mean(axis=1)
+                            next_report = time.monotonic() + PROGRESS_INTERVAL
+
+                        codes = chunk['UF'].cat.codes.to_numpy()
+                        has_uf = codes >= 0
+                        codes = codes[has_uf]
+                        k = len(present_scores)
+
+                        # One [rows x metrics] float64 block reused for scores, row mean and Is_Public
+                        # (the DataFrame is never round-tripped per metric column)
+                        mat = np.empty((len(codes), len(metrics)))
+                        score_arr = mat[:, :k]
+                        score_arr[:] = chunk[present_scores].to_numpy(dtype=np.float64)[has_uf]
+                        # 0 -> NaN already applied by the reader; putmask also covers '0.00'-style literals
+                        np.putmask(score_arr, score_arr == 0.0, np.nan)
+
+                        # 5. Mean of Scores: NaN-aware row mean in one NumPy pass (rows without any score stay NaN)
+                        if k:
+                            n_valid = np.count_nonzero(~np.isnan(score_arr), axis=1)
+                            with np.errstate(invalid='ignore', divide='ignore'):
+                                mat[:, k] = np.nansum(score_arr, axis=1) / n_valid
                         else:
-                            chunk['Mean_General'] = np.nan
-
-                        target_cols = present_scores + ['Mean_General']
+                            mat[:, k] = np.nan
 
-                        # 6. Public/Private Map
+                        # 6. Public/Private Map: masked stores straight into the Is_Public column (NaN = unknown)
+                        is_pub = mat[:, -1]
+                        is_pub[:] = np.nan
                         if 'SCHOOL_TYPE' in chunk.columns:
-                            conditions = [chunk['SCHOOL_TYPE'].isin([2]), chunk['SCHOOL_TYPE'].isin([3])]
-                            choices = [1, 0] 
-                            chunk['Is_Public'] = np.select(conditions, choices, default=np.nan)
+                            school = chunk['SCHOOL_TYPE'].to_numpy()[has_uf]
+                            is_pub[school == 2] = 1.0
+                            is_pub[school == 3] = 0.0
                         elif 'SCHOOL_DEP' in chunk.columns:
-                            conditions = [chunk['SCHOOL_DEP'].isin([1, 2, 3]), chunk['SCHOOL_DEP'] == 4]
-                            choices = [1, 0]
-                            chunk['Is_Public'] = np.select(conditions, choices, default=np.nan)
-                        else:
-                            chunk['Is_Public'] = np.nan
+                            school = chunk['SCHOOL_DEP'].to_numpy()[has_uf]
+                            is_pub[(school >= 1) & (school <= 3)] = 1.0
+                            is_pub[school == 4] = 0.0
 
-                        # 7. Aggregation
-                        sq_cols = chunk[target_cols].pow(2)
-                        sq_cols.columns = [f"{c}_sq" for c in target_cols]
-                        chunk_sq = pd.concat([chunk[['UF']], sq_cols], axis=1)
-                        
-                        g_scores = chunk.groupby('UF')[target_cols].agg(['sum', 'count'])
-                        g_sq = chunk_sq.groupby('UF')[[c for c in chunk_sq.columns if '_sq' in c]].sum()
-                        g_net = chunk.groupby('UF')['Is_Public'].agg(['sum', 'count'])
-                        g_net.columns = ['Public_Sum', 'Network_Valid_Count']
-
-                        chunk_res = pd.concat([g_scores, g_sq, g_net], axis=1)
-                        agg_storage.append(chunk_res)
+                        # 7. Aggregation: one fused scatter pass (sum, sum of squares, count) over every metric at once
+                        uf_rows += np.bincount(codes, minlength=n_uf)
+                        accumulate_state(codes, mat, sums, sqsums, counts)
 
             # --- CONSOLIDATION ---
-            if not agg_storage:
+            if not uf_rows.any():
                 print("\n   [WARN] No data after filtering.")
                 return
 
             print(f"\n   [INFO] Consolidating metrics...")
-            full_agg = pd.concat(agg_storage).groupby(level=0).sum()
+            acc = {}
+            for j, col in enumerate(metrics[:-1]):
+                acc[(col, 'sum')], acc[(col, 'count')], acc[f"{col}_sq"] = sums[:, j], counts[:, j], sqsums[:, j]
+            acc['Public_Sum'], acc['Network_Valid_Count'] = sums[:, -1], counts[:, -1]
+            full_agg = pd.DataFrame(acc, index=pd.Index(UF_DTYPE.categories, name='UF'))[uf_rows > 0]
             final_df = pd.DataFrame(index=full_agg.index)
             
             present_scores = [c for c in ['Natural_Sciences', 'Humanities', 'Language', 'Math', 'Essay'] if (c, 'sum') in full_agg.columns]
@@ -264,7 +340,7 @@ class EnemPipeline:
             
             # --- SAVING ---
             final_df = final_df.reset_index()
-            final_df['Region'] = final_df['UF'].map(UF_REGION_MAP)
+            final_df['Region'] = pd.Categorical.from_codes(UF_REGION_CODES[final_df['UF'].astype(UF_DTYPE).cat.codes], dtype=REGION_DTYPE)
             final_df['Year'] = str(self.year)
             
             # Tag logic
@@ -278,8 +354,13 @@ class EnemPipeline:
             csv_path = os.path.join(DATA_PROCESSED, f"{fname}.csv")
             xlsx_path = os.path.join(REPORT_XLSX, f"{fname}.xlsx")
             
-            final_df.to_csv(csv_path, index=False)
-            final_df.to_excel(xlsx_path, index=False)
+            # One Arrow table feeds both the C++ CSV writer and the columnar copy
+            # (the panel builder prefers the .parquet sibling)
+            table = pa.Table.from_pandas(final_df, preserve_index=False)
+            pacsv.write_csv(table, csv_path, write_options=pacsv.WriteOptions(quoting_style='none'))
+            pq.write_table(table, os.path.join(DATA_PROCESSED, f"{fname}.parquet"), compression='zstd')
+            with pd.ExcelWriter(xlsx_path, engine='xlsxwriter') as writer:
+                final_df.to_excel(writer, index=False)
             
             print(f"   -> Saved: {fname}.xlsx")
             self.logger.info(f"SUCCESS. Saved {fname}")
@@ -290,8 +371,14 @@ class EnemPipeline:
             import traceback
             traceback.print_exc()
 
+def run_year(task):
+    """Worker: processes one year (top-level so the ProcessPoolExecutor can pickle it)."""
+    year, path = task
+    EnemPipeline(year, path).process()
+
 def main():
-    os.system('cls' if os.name == 'nt' else 'clear')
+    if os.name == 'nt': os.system('')  # enable ANSI escape handling on the Windows console
+    print('\033[2J\033[H', end='', flush=True)
     print("=== ENEM UNIFIED PIPELINE v3.3 (Documented) ===")
     
     raw = input_timeout(">> Years (e.g. 2024)", timeout=5, default="2015, 2018, 2022, 2023, 2024")
@@ -303,6 +390,7 @@ def main():
     print(f"\n[QUEUE] Processing: {years}")
     print("-" * 50)
 
+    tasks = []
     for y in years:
         default_path = os.path.join(DATA_RAW, f"microdados_enem_{y}.zip")
         final_path = None
@@ -315,8 +403,17 @@ def main():
                 final_path = user_path
         
         if final_path:
-            pipeline = EnemPipeline(y, final_path)
-            pipeline.process()
+            tasks.append((y, final_path))
+
+    # Years are independent (separate ZIPs): one process per year.
+    # Each year already parses on Arrow's multithreaded CSV reader, so workers stay at half the cores.
+    if len(tasks) > 1:
+        cpus = os.cpu_count() or 1
+        workers = min(len(tasks), max(1, cpus // 2))
+        with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context('spawn')) as ex:
+            list(ex.map(run_year, tasks))
+    else:
+        for task in tasks: run_year(task)
 
     print("\n[DONE] Pipeline finished.")
 
@@ -2,6 +2,8 @@ import pandas as pd
 import numpy as np
 import zipfile
 import os
+import importlib
+import time
 
 # --- configuração ---
 anos = [2022, 2023, 2024]
@@ -9,11 +11,19 @@ input_dir = 'data/raw'
 output_dir = 'analise_exploratoria'
 
 cols_enem = ['SG_UF_PROVA', 'NU_NOTA_CN', 'NU_NOTA_CH', 'NU_NOTA_LC', 'NU_NOTA_MT', 'NU_NOTA_REDACAO']
+cols_notas = [c for c in cols_enem if c.startswith('NU_NOTA')]
+# categorias fixas: os códigos de uf são os mesmos em todos os blocos
+ufs = ['AC', 'AL', 'AM', 'AP', 'BA', 'CE', 'DF', 'ES', 'GO', 'MA', 'MG', 'MS', 'MT', 'PA', 'PB',
+       'PE', 'PI', 'PR', 'RJ', 'RN', 'RO', 'RR', 'RS', 'SC', 'SE', 'SP', 'TO']
+# tipos definidos na leitura: notas em float32 (0-1000, 1 casa decimal) e uf como categoria
+dtypes_enem = {c: 'float32' for c in cols_notas}
+dtypes_enem['SG_UF_PROVA'] = pd.CategoricalDtype(ufs)
 map_nomes = {'NU_NOTA_LC': 'linguagem', 'NU_NOTA_CH': 'humanas', 'NU_NOTA_CN': 'natureza', 'NU_NOTA_MT': 'matematica', 'NU_NOTA_REDACAO': 'redacao'}
 
 def processar_trienio():
     os.makedirs(output_dir, exist_ok=True)
     resumo_nacional = []
+    tabelas_uf = {}  # tabelas por uf em memória, repassadas à consolidação estadual
 
     for ano in anos:
         zip_path = os.path.join(input_dir, f'microdados_enem_{ano}.zip')
@@ -38,39 +48,50 @@ def processar_trienio():
             
             print(f"✅ arquivo identificado pelo tamanho ({csv_info.file_size / 1e9:.2f} GB): {csv_internal}")
 
-            chunks_list = []
+            # acumuladores por uf (soma em float64 e contagem): memória fixa, sem concat no final
+            somas = np.zeros((len(ufs), len(cols_notas)))
+            contagens = np.zeros(len(ufs), dtype=np.int64)
             try:
                 with z.open(csv_internal) as f:
                     # leitura em blocos
-                    reader = pd.read_csv(f, sep=';', encoding='latin-1', usecols=cols_enem, chunksize=300000)
+                    reader = pd.read_csv(f, sep=';', encoding='latin-1', usecols=cols_enem, dtype=dtypes_enem, chunksize=300000)
                     
+                    proximo_aviso = time.monotonic() + 1.0
                     for i, chunk in enumerate(reader):
-                        chunk = chunk.dropna(subset=['NU_NOTA_CN', 'NU_NOTA_CH', 'NU_NOTA_LC', 'NU_NOTA_MT', 'NU_NOTA_REDACAO'])
-                        if not chunk.empty:
-                            chunks_list.append(chunk)
-                        if i % 10 == 0: 
+                        chunk = chunk.dropna(subset=cols_notas)
+                        codigos = chunk['SG_UF_PROVA'].cat.codes.to_numpy()
+                        validos = codigos >= 0
+                        if validos.any():
+                            codigos = codigos[validos]
+                            np.add.at(somas, codigos, chunk[cols_notas].to_numpy(dtype=np.float64)[validos])
+                            contagens += np.bincount(codigos, minlength=len(ufs))
+                        # progresso por tempo (no máximo 1 aviso por segundo), não a cada n blocos
+                        if time.monotonic() >= proximo_aviso:
                             print(f"⏳ {ano}: processando bloco {i}...")
+                            proximo_aviso = time.monotonic() + 1.0
 
-                if not chunks_list:
+                if not contagens.any():
                     print(f"⚠️ aviso: o ano {ano} não retornou dados válidos.")
                     continue
 
-                df_ano_completo = pd.concat(chunks_list)
-
-                # 1. tabela por uf
-                df_uf = df_ano_completo.groupby('SG_UF_PROVA').mean()
+                # 1. tabela por uf (médias = soma / contagem, só ufs observadas)
+                presentes = contagens > 0
+                df_uf = pd.DataFrame(somas[presentes] / contagens[presentes, None], columns=cols_notas,
+                                     index=pd.Index(np.array(ufs)[presentes], name='SG_UF_PROVA'))
                 df_uf['media'] = df_uf.mean(axis=1)
                 df_uf['desvio_padrao'] = df_uf[['NU_NOTA_CN', 'NU_NOTA_CH', 'NU_NOTA_LC', 'NU_NOTA_MT', 'NU_NOTA_REDACAO']].std(axis=1)
                 df_uf = df_uf.rename(columns=map_nomes).sort_values(by='media', ascending=False)
                 
                 df_uf.to_csv(os.path.join(output_dir, f'tabela_enem_{ano}.csv'), sep=';', encoding='utf-8-sig')
-                df_uf.to_excel(os.path.join(output_dir, f'tabela_enem_{ano}.xlsx'))
+                with pd.ExcelWriter(os.path.join(output_dir, f'tabela_enem_{ano}.xlsx'), engine='xlsxwriter') as writer:
+                    df_uf.to_excel(writer)
+                tabelas_uf[ano] = df_uf
 
                 # 2. métricas nacionais
-                medias_nac = df_ano_completo[['NU_NOTA_CN', 'NU_NOTA_CH', 'NU_NOTA_LC', 'NU_NOTA_MT', 'NU_NOTA_REDACAO']].mean()
-                linha_resumo = medias_nac.to_dict()
+                total = int(contagens.sum())
+                linha_resumo = dict(zip(cols_notas, somas.sum(axis=0) / total))
                 linha_resumo['ano'] = ano
-                linha_resumo['participantes_validos'] = len(df_ano_completo)
+                linha_resumo['participantes_validos'] = total
                 resumo_nacional.append(linha_resumo)
 
             except Exception as e:
@@ -80,9 +101,15 @@ def processar_trienio():
         df_consolidado = pd.DataFrame(resumo_nacional).set_index('ano').rename(columns=map_nomes)
         df_consolidado['media_geral_brasil'] = df_consolidado[['linguagem', 'humanas', 'natureza', 'matematica', 'redacao']].mean(axis=1)
         df_consolidado.to_csv(os.path.join(output_dir, 'tabela_consolidada_nacional_trienio.csv'), sep=';', encoding='utf-8-sig')
-        df_consolidado.to_excel(os.path.join(output_dir, 'tabela_consolidada_nacional_trienio.xlsx'))
+        with pd.ExcelWriter(os.path.join(output_dir, 'tabela_consolidada_nacional_trienio.xlsx'), engine='xlsxwriter') as writer:
+            df_consolidado.to_excel(writer)
         print("\n✨ processamento do triênio finalizado!")
         print(df_consolidado[['media_geral_brasil', 'participantes_validos']])
 
+    return tabelas_uf
+
 if __name__ == "__main__":
-    processar_trienio()
\ No newline at end of file
+    tabelas_uf = processar_trienio()
+    # consolidação estadual no mesmo processo: usa as tabelas em memória, sem reler os csv recém-gravados
+    if tabelas_uf:
+        importlib.import_module('02_consolidar_medias_trienio').gerar_tabela_consolidada(tabelas_uf)
\ No newline at end of file
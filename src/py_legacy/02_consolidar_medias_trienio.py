@@ -41,7 +41,8 @@ def gerar_tabela_consolidada():
 
     # salvando em excel
     try:
-        df_final.to_excel(output_file, index=False)
+        with pd.ExcelWriter(output_file, engine='xlsxwriter') as writer:
+            df_final.to_excel(writer, index=False)
         print(f"✅ sucesso! arquivo salvo em: {output_file}")
     except Exception as e:
         print(f"❌ erro ao salvar o excel: {e}")
@@ -59,12 +60,19 @@ arquivos = {
     2024: 'tabela_enem_2024.csv'
 }
 
-def gerar_tabela_consolidada():
-    dfs_anos = []
+def gerar_tabela_consolidada(tabelas=None):
+    # tabelas: {ano: tabela por uf} já em memória (passo 01 no mesmo processo); sem elas, lê os csv
+    tabelas = tabelas or {}
+    medias_anos = []
 
     print("📂 iniciando consolidação dos dados estaduais...")
 
     for ano, nome_arquivo in arquivos.items():
+        if ano in tabelas:
+            medias_anos.append(tabelas[ano]['media'].rename_axis('uf').rename(f'media_{ano}'))
+            print(f"✅ dados de {ano} recebidos em memória.")
+            continue
+
         caminho_completo = os.path.join(input_dir, nome_arquivo)
         
         if os.path.exists(caminho_completo):
@@ -75,23 +83,17 @@ def gerar_tabela_consolidada():
             # alguns arquivos usam 'SG_UF_PROVA', outros podem usar 'uf'
             col_uf = 'SG_UF_PROVA' if 'SG_UF_PROVA' in df.columns else 'uf'
             
-            df = df[[col_uf, 'media']].rename(columns={
-                col_uf: 'uf', 
-                'media': f'media_{ano}'
-            })
-            dfs_anos.append(df)
+            medias_anos.append(df.set_index(col_uf)['media'].rename_axis('uf').rename(f'media_{ano}'))
             print(f"✅ dados de {ano} carregados.")
         else:
             print(f"⚠️ arquivo não encontrado: {caminho_completo}")
 
-    if not dfs_anos:
+    if not medias_anos:
         print("❌ erro: nenhum arquivo csv foi encontrado na pasta 'analise_exploratoria'.")
         return
 
-    # unindo os anos através da sigla do estado
-    df_final = dfs_anos[0]
-    for df_ano in dfs_anos[1:]:
-        df_final = df_final.merge(df_ano, on='uf', how='outer')
+    # unindo os anos através da sigla do estado: um único concat alinhado pelo índice uf (sem cadeia de merges)
+    df_final = pd.concat(medias_anos, axis=1, join='outer').reset_index()
 
     # calculando a média das médias (triênio)
     colunas_medias = [c for c in df_final.columns if c.startswith('media_')]
@@ -102,7 +104,8 @@ def gerar_tabela_consolidada():
 
     # salvando o resultado final em excel
     try:
-        df_final.to_excel(output_file, index=False)
+        with pd.ExcelWriter(output_file, engine='xlsxwriter') as writer:
+            df_final.to_excel(writer, index=False)
         print(f"\n✨ sucesso! a tabela consolidada foi salva em: {output_file}")
     except Exception as e:
         print(f"\n❌ erro ao salvar o arquivo excel: {e}")
@@ -48,7 +48,7 @@ def gerar_amostra_visual():
 
     # 3. Filtrar Brasil
     print("🇧🇷 Filtrando alunos do Brasil...")
-    df_bra = df[df['CNT'] == 'BRA'].copy()
+    df_bra = df[df['CNT'] == 'BRA']
     print(f"   Total de alunos encontrados: {len(df_bra)}")
 
     # 4. Criar o 'Sanduíche' (Primeiras 50 + Últimas 50 linhas)